@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare the 'thread' and 'asyncio' server engines.
+
+For each engine and number of connections, a server is started in a child
+process, the connections are opened and each creates a remote list. Reported
+are the server's thread count and resident memory while holding the
+connections, and the request rate for round-robin calls over all of them.
+
+Usage: bench_engines.py [--connections 10 1000 10000] [--calls 20000]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import resource
+import socket
+import time
+
+from crouton import Server, Client
+
+
+HOST = 'localhost'
+PORT = 5003
+
+
+def serve(engine, port):
+    logging.getLogger('server').setLevel(logging.WARNING)
+    server = Server()
+    server.register_type(list)
+    server.run(host=HOST, port=port, engine=engine)
+
+
+def wait_listening(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start listening.')
+
+
+def server_status(pid):
+    status = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return int(status['Threads']), int(status['VmRSS'].split()[0]) // 1024
+
+
+def bench(engine, connections, calls, port):
+    proc = multiprocessing.Process(target=serve, args=(engine, port),
+                                   daemon=True)
+    proc.start()
+    try:
+        wait_listening(port)
+        start = time.perf_counter()
+        # Shared memory only works with the thread engine, so both engines
+        # are compared on TCP
+        clients = [Client(host=HOST, port=port, shared_memory=False)
+                   for _ in range(connections)]
+        objs = [cli.factory(list) for cli in clients]
+        connect_time = time.perf_counter() - start
+        threads, rss = server_status(proc.pid)
+        start = time.perf_counter()
+        for i in range(calls):
+            objs[i % connections].append(i)
+        rate = calls / (time.perf_counter() - start)
+        print('{:<8} {:>7} {:>10.2f} {:>8} {:>9} {:>10.0f}'.format(
+            engine, connections, connect_time, threads, rss, rate))
+        del objs, clients
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--connections', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--engines', nargs='+', default=['thread', 'asyncio'])
+    args = parser.parse_args()
+    # Each connection needs a descriptor in this process
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = max(args.connections) + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    print('{:<8} {:>7} {:>10} {:>8} {:>9} {:>10}'.format(
+        'engine', 'conns', 'connect s', 'threads', 'rss MiB', 'calls/s'))
+    for connections in args.connections:
+        for i, engine in enumerate(args.engines):
+            try:
+                bench(engine, connections, args.calls, PORT + i)
+            except Exception as ex:
+                print('{:<8} {:>7} failed: {!r}'.format(engine, connections, ex))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Compare in-server and process-isolated execution of a CPU-bound type.
+
+A server is started in a child process with the same pure-Python type
+registered twice: once in the server and once isolated in worker processes.
+Concurrent clients, one thread each, call the CPU-bound method on their own
+instance for a fixed time and the aggregate call rate is reported.
+
+Usage: bench_isolation.py [--clients 1 2 4 8] [--duration 3]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from threading import Thread
+
+from crouton import Server, Client
+
+
+HOST = 'localhost'
+PORT = 5005
+
+
+class Cruncher:
+
+    def crunch(self, n):
+        total = 0
+        for i in range(n):
+            total += i * i % 7
+        return total
+
+
+def serve(processes):
+    logging.getLogger('server').setLevel(logging.WARNING)
+    server = Server()
+    server.register_type(Cruncher)
+    server.register_type(Cruncher, name='IsolatedCruncher',
+                         processes=processes)
+    server.run(host=HOST, port=PORT, max_workers=64)
+
+
+def wait_listening(timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start listening.')
+
+
+def bench(provider, clients, duration, work):
+    counts = [0] * clients
+
+    def run(i):
+        obj = Client(host=HOST, port=PORT).factory(provider)
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            obj.crunch(work)
+            counts[i] += 1
+
+    threads = [Thread(target=run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--work', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    # Not daemonic, the server starts worker processes of its own
+    proc = multiprocessing.Process(target=serve, args=(args.processes,))
+    proc.start()
+    try:
+        wait_listening()
+        print('{:>7} {:>12} {:>12} {:>8}'.format(
+            'clients', 'server/s', 'isolated/s', 'speedup'))
+        for clients in args.clients:
+            shared = bench('Cruncher', clients, args.duration, args.work)
+            isolated = bench('IsolatedCruncher', clients, args.duration,
+                             args.work)
+            print('{:>7} {:>12.1f} {:>12.1f} {:>7.2f}x'.format(
+                clients, shared, isolated, isolated / shared))
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+if __name__ == '__main__':
+    main()
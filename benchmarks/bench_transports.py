@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Compare the transports of same-host clients.
+
+A server listening on a TCP port and a Unix domain socket is started in a
+child process, and one listening in-process in a thread, and a client of
+each transport creates a remote list.
+Reported are the mean round trip of small calls, and the throughput of large
+payloads sent to the server and returned.
+
+Usage: bench_transports.py [--calls 20000] [--size 64] [--repeat 5]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from crouton import Server, Client
+
+
+HOST = 'localhost'
+PORT = 5006
+PATH = os.path.join(tempfile.gettempdir(), 'crouton-bench.sock')
+INPROC = 'inproc://crouton-bench'
+
+
+def serve(port, path, url=None):
+    logging.getLogger('server').setLevel(logging.WARNING)
+    server = Server()
+    server.register_type(list)
+    server.run(host=HOST, port=port, path=path, url=url)
+
+
+def wait_listening(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start listening.')
+
+
+def connect_inproc(timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return Client(url=INPROC)
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start listening.')
+
+
+def bench(name, client, calls, size, repeat):
+    obj = client.factory(list)
+    obj.append(0)
+    start = time.perf_counter()
+    for _ in range(calls):
+        obj.__len__()
+    latency = (time.perf_counter() - start) / calls * 1e6
+    data = bytes(size * 2**20)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        obj[0] = data
+        obj[0]
+    throughput = 2 * repeat * size / (time.perf_counter() - start)
+    print('{:<14} {:>10.1f} {:>10.0f}'.format(name, latency, throughput))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=64,
+                        help='payload MiB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    proc = multiprocessing.Process(target=serve, args=(PORT, PATH),
+                                   daemon=True)
+    proc.start()
+    try:
+        wait_listening(PORT)
+        print('{:<14} {:>10} {:>10}'.format('transport', 'call us',
+                                            'MiB/s'))
+        bench('tcp', Client(host=HOST, port=PORT),
+              args.calls, args.size, args.repeat)
+        bench('tcp nagle',
+              Client(url='tcp://{}:{}?nodelay=0'.format(HOST, PORT)),
+              args.calls, args.size, args.repeat)
+        bench('unix', Client(path=PATH),
+              args.calls, args.size, args.repeat)
+        bench('shared memory', Client(host=HOST, port=PORT,
+                                      shared_memory=True),
+              args.calls, args.size, args.repeat)
+        threading.Thread(target=serve, args=(None, None, INPROC),
+                         daemon=True).start()
+        bench('inproc', connect_inproc(), args.calls, args.size,
+              args.repeat)
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,5 @@
 from .server import Server
-from .client import Client
\ No newline at end of file
+from .client import Client
+from .async_client import AsyncClient
+from .codec import register_codec
+from .transport import register_transport
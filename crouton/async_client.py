@@ -0,0 +1,528 @@
+from collections import deque
+from itertools import count
+import asyncio
+
+from .client import RemoteError, RELEASE_BATCH, RELEASE_INTERVAL, \
+    ITERATE_BATCH, ITERATE_MAX_BATCH, check_decoded, exit_args
+from .codec import CODECS, encode_reference, ext_hook, new_packer, \
+    new_unpacker, pack_buffers, receive_buffers, resolve
+from .transport import client_transport
+
+
+class AsyncClient:
+
+    def __init__(self, reader, writer):
+        """Client for asyncio applications, use connect() to make one. Many
+        requests may be in flight, each completes as its response arrives.
+
+        Args:
+            reader (StreamReader): connection reader
+            writer (StreamWriter): connection writer
+        """
+        self._reader = reader
+        self._writer = writer
+        self._loop = asyncio.get_running_loop()
+        self._packer = new_packer(default=self._default)
+        self._unpacker = new_unpacker(ext_hook=ext_hook)
+        self._ids = count()
+        # Futures by [request id]
+        self._pending = {}
+        # Instance ids of released references, sent with the next request
+        self._released = deque()
+        self._closed = False
+        self._read_task = self._loop.create_task(self._read())
+        self._flush_task = self._loop.create_task(self._flush_periodically())
+
+    @classmethod
+    async def connect(cls, host='localhost', port=5000, path=None, url=None):
+        """Connect to a server.
+
+        Args:
+            host (str, optional): host, default 'localhost'
+            port (int, optional): TCP port number, default 5000
+            path (str, optional): path of a Unix domain socket to connect to
+                instead of host and port, default None
+            url (str, Transport, optional): URL of the transport to connect
+                through instead, e.g. 'tcp://localhost:5000?nodelay=0',
+                default None
+
+        Returns:
+            AsyncClient: connected client
+        """
+        trans = client_transport(host, port, path, url)
+        reader, writer = await trans.open_connection()
+        return cls(reader, writer)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type_, value, traceback):
+        await self.close()
+
+    def _default(self, obj):
+        """Pack an AsyncProxy argument as a reference to its remote object,
+        other objects with the registered codecs.
+
+        Args:
+            obj (object): object msgpack can not pack
+
+        Returns:
+            msgpack.ExtType: reference, or ext type of a codec
+
+        Raises:
+            TypeError: If obj is not an AsyncProxy of this client and has no
+                codec.
+        """
+        if isinstance(obj, AsyncProxy) and obj._cli is self:
+            return encode_reference(obj._inst)
+        return CODECS.default(obj)
+
+    @property
+    def is_open(self):
+        """Is connection open?
+
+        Returns:
+            bool: is open
+        """
+        return not self._closed
+
+    async def close(self):
+        """Close the connection. The server releases all references."""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_task.cancel()
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+        await asyncio.gather(self._read_task, return_exceptions=True)
+
+    async def factory(self, provider, *args, **kwargs):
+        """Make a new instance.
+
+        Args:
+            provider (str, type): provider name or type
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            AsyncProxy: new proxy object
+        """
+        provider = provider.__name__ if isinstance(provider, type) else provider
+        return await self._request({
+            'action': 'open',
+            'provider': provider,
+            'args': args,
+            'kwargs': kwargs,
+        })
+
+    async def _execute(self, proxy, method, *args, **kwargs):
+        """Make execute request. The proxy is kept until the response
+        arrives, so its release is not sent before the request.
+
+        Args:
+            proxy (AsyncProxy): remote object
+            method (str): method name
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            object: returned object
+        """
+        return await self._request({
+            'action': 'execute',
+            'method': method,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        })
+
+    def _close(self, instance):
+        """Release a reference, queued to be sent with the next request.
+        Never blocks, so it is safe from __del__.
+
+        Args:
+            instance (int): object ID
+        """
+        self._released.append(instance)
+        if len(self._released) == RELEASE_BATCH and not self._closed:
+            try:
+                self._loop.call_soon_threadsafe(self._flush)
+            except RuntimeError:
+                # Event loop closed
+                pass
+
+    def _flush(self):
+        """Send queued released references in a close request, without
+        waiting for the response.
+        """
+        if self._released and not self._closed:
+            self._send({
+                'action': 'close',
+                'instances': self._take_released(),
+            }, oneway=True)
+
+    async def _flush_periodically(self):
+        """Send queued released references every RELEASE_INTERVAL."""
+        while True:
+            await asyncio.sleep(RELEASE_INTERVAL)
+            self._flush()
+
+    def _take_released(self):
+        """Take the queued released references.
+
+        Returns:
+            list: instance ids
+        """
+        released = []
+        while self._released:
+            released.append(self._released.popleft())
+        return released
+
+    def _send(self, obj, oneway=False):
+        """Send a request, with queued released references.
+
+        Args:
+            obj (dict): request
+            oneway (bool, optional): executed in order without a response,
+                default False
+
+        Returns:
+            Future: completed with the response, None if oneway
+
+        Raises:
+            ConnectionError: If the connection is closed.
+        """
+        if self._closed:
+            raise ConnectionError('Connection closed.')
+        if self._released:
+            obj['release'] = self._take_released()
+        if oneway:
+            obj['oneway'] = True
+            self._write(pack_buffers(self._packer, obj))
+            return None
+        obj['id'] = next(self._ids)
+        data = pack_buffers(self._packer, obj)
+        future = self._loop.create_future()
+        self._pending[obj['id']] = future
+        self._write(data)
+        return future
+
+    def _write(self, data):
+        """Write a request.
+
+        Args:
+            data (bytes, list): request data, or chunks of it, see
+                pack_buffers()
+        """
+        if isinstance(data, list):
+            # Copied, as arrays may change before the data is sent
+            data = b''.join(data)
+        self._writer.write(data)
+
+    async def _request(self, obj):
+        """Make a request. If cancelled, the response is discarded once it
+        arrives, releasing any references in it.
+
+        Args:
+            obj (dict): request
+
+        Returns:
+            object: returned value
+
+        Raises:
+            RemoteError: On remote request error.
+        """
+        future = self._send(obj)
+        try:
+            await self._writer.drain()
+            response = await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        return self._result(response)
+
+    def _result(self, obj):
+        """Get the result of a response.
+
+        Args:
+            obj (dict): response
+
+        Returns:
+            object: returned value, or a tuple of items and whether the
+                iteration is done for an iterate request
+
+        Raises:
+            RemoteError: On remote request error.
+            TypeError: On invalid response.
+        """
+        ret_type = obj['type']
+        if ret_type == 'value':
+            if obj.get('references'):
+                return resolve(obj['value'], self._proxy)
+            return obj['value']
+        elif ret_type == 'reference':
+            return AsyncProxy(self, obj['value'])
+        elif ret_type == 'method':
+            return METHOD
+        elif ret_type == 'items':
+            items = obj['value']
+            if obj.get('references'):
+                items = resolve(items, self._proxy)
+            return items, obj['done']
+        elif ret_type == 'error':
+            raise RemoteError(obj['value'])
+        raise TypeError('Invalid response.')
+
+    def _proxy(self, reference):
+        """Make the proxy of a reference.
+
+        Args:
+            reference (Reference): reference to a remote object
+
+        Returns:
+            AsyncProxy: proxy
+        """
+        return AsyncProxy(self, reference.instance)
+
+    def _discard(self, obj):
+        """Discard a response, releasing its references.
+
+        Args:
+            obj (dict): response
+        """
+        try:
+            self._result(obj)
+        except Exception:
+            pass
+
+    def _discard_future(self, future):
+        """Discard the response of a done future, releasing its references.
+
+        Args:
+            future (Future): response
+        """
+        if not future.cancelled() and future.exception() is None:
+            self._discard(future.result())
+
+    async def _read(self):
+        """Receive responses and route them to the futures of their
+        requests, until the connection is closed.
+        """
+        try:
+            while True:
+                chunk = await self._reader.read(1048576)
+                if not chunk:
+                    break
+                self._unpacker.feed(chunk)
+                for response in self._unpacker:
+                    # Checked before awaiting, while no other client unpacks
+                    response = check_decoded(response)
+                    for view in receive_buffers(self._unpacker):
+                        view[:] = await self._reader.readexactly(len(view))
+                    future = self._pending.pop(response.get('id'), None)
+                    if future is None or future.cancelled():
+                        # Cancelled request, or one never awaited
+                        self._discard(response)
+                    else:
+                        future.set_result(response)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._closed = True
+            self._flush_task.cancel()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection closed.'))
+
+
+class AsyncMethod:
+
+    def __init__(self, proxy, name):
+        """Method of a remote object. A call returns an awaitable of its
+        result.
+
+        Args:
+            proxy (AsyncProxy): remote object
+            name (str): method name
+        """
+        self._proxy = proxy
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        proxy = self._proxy
+        return proxy._cli._execute(proxy, self._name, *args, **kwargs)
+
+    def __repr__(self):
+        return '<remote method {}>'.format(self._name)
+
+    async def oneway(self, *args, **kwargs):
+        """Call the method without a response, see Method.oneway().
+
+        Args:
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+        """
+        proxy = self._proxy
+        proxy._cli._send({
+            'action': 'execute',
+            'method': self._name,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        }, oneway=True)
+        await proxy._cli._writer.drain()
+
+
+class AsyncAttribute(AsyncMethod):
+
+    """Attribute of a remote object, not yet looked up. Await it to look it
+    up, or call it to call the method by that name without a lookup.
+    """
+
+    def __await__(self):
+        return self._get().__await__()
+
+    def __repr__(self):
+        return '<remote attribute {}>'.format(self._name)
+
+    async def _get(self):
+        """Look up the attribute.
+
+        Returns:
+            object: attribute value, or AsyncMethod for a method
+        """
+        proxy = self._proxy
+        ret = await proxy._cli._execute(proxy, '__getattr__', self._name)
+        if ret is METHOD:
+            return AsyncMethod(proxy, self._name)
+        return ret
+
+
+# Result of __getattr__ for a method, see AsyncAttribute
+METHOD = object()
+
+
+class AsyncProxy:
+
+    def __init__(self, client, instance):
+        """Remote object of an AsyncClient. Operations return awaitables:
+
+            await proxy.method(x)
+            value = await proxy.attribute
+            item = await proxy[key]
+            async for item in proxy: ...
+            async with proxy as obj: ...
+
+        Operations that can not be awaited, such as len() or assignment, are
+        made by calling the special method, e.g. await proxy.__len__().
+
+        Args:
+            client (AsyncClient): client
+            instance (int): object ID
+        """
+        object.__setattr__(self, '_cli', client)
+        object.__setattr__(self, '_inst', instance)
+
+    def __del__(self):
+        if self._cli.is_open:
+            self._cli._close(self._inst)
+
+    def __repr__(self):
+        return '<AsyncProxy {}>'.format(self._inst)
+
+    def __getattr__(self, name):
+        return AsyncAttribute(self, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Use await proxy.__setattr__(name, value).')
+
+    def __delattr__(self, name):
+        raise AttributeError('Use await proxy.__delattr__(name).')
+
+    def __call__(self, *args, **kwargs):
+        return self._cli._execute(self, '__call__', *args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._cli._execute(self, '__getitem__', key)
+
+    def __aiter__(self):
+        return AsyncIterator(self)
+
+    async def __anext__(self):
+        items, done = self._cli._result(await self._cli._send({
+            'action': 'iterate',
+            'instance': self._inst,
+            'count': 1,
+        }))
+        if not items:
+            raise StopAsyncIteration
+        return items[0]
+
+    async def __aenter__(self):
+        return await self._cli._execute(self, '__enter__')
+
+    async def __aexit__(self, type_, value, traceback):
+        return await self._cli._execute(self, '__exit__',
+                                        *exit_args(type_, value))
+
+
+class AsyncIterator:
+
+    def __init__(self, proxy):
+        """Asynchronous iterator over a remote iterable, fetching items in
+        batches like Iterator.
+
+        Args:
+            proxy (AsyncProxy): remote iterable
+        """
+        self._proxy = proxy
+        self._iterator = None
+        self._batch = ITERATE_BATCH
+        self._items = deque()
+        self._future = None
+        self._done = False
+
+    def __del__(self):
+        future = getattr(self, '_future', None)
+        if not future is None:
+            # Release the references of a batch never consumed
+            client = self._proxy._cli
+            future.add_done_callback(client._discard_future)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = await self._proxy._cli._execute(
+                self._proxy, '__iter__')
+            self._future = self._fetch()
+        if not self._items:
+            if self._future is None:
+                raise StopAsyncIteration
+            future, self._future = self._future, None
+            items, done = self._iterator._cli._result(await future)
+            if not done:
+                self._future = self._fetch()
+            self._items.extend(items)
+            if not self._items:
+                raise StopAsyncIteration
+        return self._items.popleft()
+
+    def _fetch(self):
+        """Request the next batch.
+
+        Returns:
+            Future: completed with the response
+        """
+        future = self._iterator._cli._send({
+            'action': 'iterate',
+            'instance': self._iterator._inst,
+            'count': self._batch,
+        })
+        self._batch = min(self._batch * 2, ITERATE_MAX_BATCH)
+        return future
@@ -1,58 +1,130 @@
+from concurrent.futures import Future, InvalidStateError
+from collections import deque
+from itertools import count
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread, current_thread, local
+import weakref
 import socket
-from threading import Lock
-import msgpack
-try:
-    import msgpack_numpy
-    msgpack_numpy.patch()
-except ImportError:
-    # msgpack_numpy is optional
-    pass
+import time
+from .codec import CODECS, Reference, decode_error, encode_reference, \
+    ext_hook, new_packer, new_unpacker, pack_buffers, receive_buffers, \
+    recv_into, resolve
+from .shm import RING_SIZE, SharedMemoryChannel, is_local
+from .transport import client_transport
+
+
+# Released references are sent once this many are queued
+RELEASE_BATCH = 64
+# Seconds between sends of queued released references
+RELEASE_INTERVAL = 0.5
+# Number of items fetched by the first and by later requests of an iteration
+ITERATE_BATCH = 16
+ITERATE_MAX_BATCH = 1024
+
+# Flusher shared by all clients of the process, see flusher()
+_flusher = None
+_flusher_lock = Lock()
 
 
 class Client:
 
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, shared_memory=False,
+                 path=None, url=None):
         """Client object.
 
         Args:
             host (str, optional): host, default 'localhost'
             port (int, optional): TCP port number, default 5000
+            shared_memory (bool, optional): exchange requests and responses
+                through shared memory if the server is on the same host and
+                supports it, default False. It pays for large payloads, each
+                connection takes two rings of RING_SIZE bytes.
+            path (str, optional): path of a Unix domain socket to connect to
+                instead of host and port, default None
+            url (str, Transport, optional): URL of the transport to connect
+                through instead, e.g. 'tcp://localhost:5000?nodelay=0',
+                default None
         """
         self._lock = Lock()
         self._socket = None
-        self._packer = msgpack.Packer(use_bin_type=True)
-        """
-        For backwards compatibility, try these kwargs in order, until one succeeds.
-        * 'encoding' and 'unicode_errors' options are deprecated. There is new 'raw' option.
-          It is True by default for backward compatibility, but it is changed to False in
-          near future. You can use raw=False instead of encoding='utf-8'.
-        * For backwards compatibility, set 'max_buffer_size' explicitly.
-        * For backwards compatibility, set 'strict_map_key' to False explicitly, when possible.
-        """
-        kwargs_list = (
-            {'strict_map_key': False, 'raw': False},
-            {'raw': False},
-            {'encoding': 'utf-8'},
-        )
-        for kwargs in kwargs_list:
-            try:
-                self._unpacker = msgpack.Unpacker(
-                    use_list=True, max_buffer_size=2**31-1, **kwargs)
-            except TypeError as ex:
-                continue
-            break
-        else:
-            raise RuntimeError('Failed to create unpacker.')
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect((host, port))
+        self._packer = new_packer(default=self._default)
+        self._unpacker = new_unpacker(ext_hook=ext_hook)
+        self._socket = client_transport(host, port, path, url).connect()
+        if shared_memory and is_local(self._socket):
+            self._connect_shared_memory()
+        self._ids = count()
+        # Proxy classes by [schema id]
+        self._proxy_types = {}
+        # Batch recording the calls of the current thread, if any
+        self._local = local()
+        # Instance ids of released references, sent with the next request
+        self._released = deque()
+        self._reader = Reader(self._socket, self._unpacker)
+        self._reader.start()
+        self._flusher = flusher()
+        self._flusher.add(self)
 
     def __del__(self):
         with self._lock:
             self._close_socket()
 
+    def _default(self, obj):
+        """Pack a Proxy argument as a reference to its remote object, other
+        objects with the registered codecs.
+
+        Args:
+            obj (object): object msgpack can not pack
+
+        Returns:
+            msgpack.ExtType: reference, or ext type of a codec
+
+        Raises:
+            TypeError: If obj is not a Proxy of this client and has no codec.
+        """
+        if isinstance(obj, Proxy) and obj._cli is self:
+            return encode_reference(obj._inst)
+        return CODECS.default(obj)
+
+    def _connect_shared_memory(self):
+        """Move the connection to shared memory, if the server accepts. The
+        socket remains to wake the ends of the channel.
+        """
+        try:
+            channel = SharedMemoryChannel.create(self._socket)
+        except OSError:
+            return
+        try:
+            self._socket.sendall(self._packer.pack({
+                'action': 'transport',
+                'shared_memory': channel.name,
+                'nonce': channel.nonce,
+                'size': RING_SIZE,
+            }))
+            response = next(self._unpacker, None)
+            while response is None:
+                chunk = self._socket.recv(4096)
+                if not chunk:
+                    # Requests fail as on any closed connection
+                    return
+                self._unpacker.feed(chunk)
+                response = next(self._unpacker, None)
+        except OSError:
+            return
+        finally:
+            # Attached by the server, or never will be
+            channel.unlink()
+        # Refused by servers that do not support it
+        if response['type'] == 'value':
+            self._socket = channel
+
     def _close_socket(self):
         """Close socket if open."""
         if not self._socket is None:
+            try:
+                # Wakes the reader thread
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self._socket.close()
             finally:
@@ -86,52 +158,212 @@ class Client:
         })
 
     def _close(self, instance):
-        """Make close request.
+        """Release a reference. The release is queued and sent with the next
+        request, or by the flusher once enough are queued or some time has
+        passed. Never blocks nor sends, so it is safe from __del__ on any
+        thread.
 
         Args:
             instance (str): object ID
+        """
+        self._released.append(instance)
+        if len(self._released) == RELEASE_BATCH:
+            self._flusher.notify(self)
+
+    def _flush(self, blocking=True):
+        """Send queued released references in a close request, without
+        waiting for the response.
+
+        Args:
+            blocking (bool, optional): wait for the lock, default True.
+                Otherwise, nothing is sent if the lock is held.
+        """
+        if not self._lock.acquire(blocking):
+            return
+        try:
+            if self._released and self.is_open:
+                self._send_locked([{
+                    'action': 'close',
+                    'instances': self._take_released(),
+                }], False, oneway=True)
+        except OSError:
+            # Server released all references with the connection
+            pass
+        finally:
+            self._lock.release()
+
+    def _take_released(self):
+        """Take the queued released references.
 
         Returns:
-            None: None object
+            list: instance ids
         """
-        return self._request({
-            'action': 'close',
-            'instance': instance,
-        })
+        released = []
+        while self._released:
+            released.append(self._released.popleft())
+        return released
 
-    def _execute(self, instance, method, *args, **kwargs):
+    def _execute(self, proxy, method, *args, **kwargs):
         """Make execute request.
 
         Args:
-            instance (str): object ID
+            proxy (Proxy): remote object
             method (str): method name
             *args: tuple of positional arguments
             **kwargs: dict of keyword arguments
 
         Returns:
-            object: returned object
+            object: returned object, or a Future of it if recorded by a batch
         """
-        return self._request({
+        request = {
+            'action': 'execute',
+            'method': method,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        }
+        batch = getattr(self._local, 'batch', None)
+        # Attribute lookups are made at once, they may be method lookups
+        if not batch is None and method != '__getattr__':
+            return batch.record(request, proxy)
+        return self._request(request)
+
+    def _oneway(self, instance, method, *args, **kwargs):
+        """Make execute request, without a response.
+
+        Args:
+            instance (str): object ID
+            method (str): method name
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+        """
+        self._send({
             'action': 'execute',
             'method': method,
             'instance': instance,
             'args': args,
             'kwargs': kwargs,
-        })
+        }, oneway=True)
 
-    def _receive(self):
-        """Receive a response.
+    def _submit(self, proxy, method, *args, **kwargs):
+        """Make execute request, without waiting for the response. The
+        proxy is kept until the response arrives, so its release is not
+        sent before the request is made.
+
+        Args:
+            proxy (Proxy): remote object
+            method (str): method name
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
 
         Returns:
-            dict: response
+            Future: returned object
         """
-        while True:
-            chunk = self._socket.recv(1048576)
-            if not chunk:
-                return None
-            self._unpacker.feed(chunk)
-            for response in self._unpacker:
-                return response
+        future = RemoteFuture(self)
+        response = self._send({
+            'action': 'execute',
+            'method': method,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        }, hold=proxy)[0]
+        response.add_done_callback(lambda response: self._complete(
+            future, response))
+        return future
+
+    def _complete(self, future, response):
+        """Complete a future with a response, called by the reader thread.
+        The response of a cancelled future is discarded.
+
+        Args:
+            future (RemoteFuture): future to complete
+            response (Future): done future of the response
+        """
+        error = response.exception()
+        try:
+            if error is None:
+                future.set_result(response.result())
+            else:
+                future.set_exception(error)
+        except InvalidStateError:
+            _discard(self, response)
+
+    def _iterate(self, instance, count):
+        """Make iterate request, without waiting for the response.
+
+        Args:
+            instance (str): object ID of an iterator
+            count (int): maximum number of items
+
+        Returns:
+            Future: completed with the response
+        """
+        return self._send({
+            'action': 'iterate',
+            'instance': instance,
+            'count': count,
+        })[0]
+
+    def _send(self, *objs, ordered=False, oneway=False, hold=None):
+        """Send requests.
+
+        Args:
+            *objs (dict): requests
+            ordered (bool, optional): executed in order rather than
+                concurrently, default False
+            oneway (bool, optional): executed in order without a response,
+                default False
+            hold (object, optional): kept until the responses arrive,
+                e.g. the proxies the requests are made on
+
+        Returns:
+            list: Futures of the responses, empty if oneway
+        """
+        with self._lock:
+            return self._send_locked(objs, ordered, oneway, hold)
+
+    def _send_locked(self, objs, ordered, oneway=False, hold=None):
+        """Send requests, with queued released references. Lock must be held.
+
+        Args:
+            objs (list): requests
+            ordered (bool): executed in order rather than concurrently
+            oneway (bool, optional): executed in order without a response,
+                default False
+            hold (object, optional): kept until the responses arrive
+
+        Returns:
+            list: Futures of the responses, empty if oneway
+        """
+        if self._released:
+            objs[0]['release'] = self._take_released()
+        data = []
+        out_of_band = False
+        try:
+            for obj in objs:
+                if oneway:
+                    obj['oneway'] = True
+                elif not ordered:
+                    obj['id'] = next(self._ids)
+                packed = pack_buffers(self._packer, obj)
+                if isinstance(packed, list):
+                    data.extend(packed)
+                    out_of_band = True
+                else:
+                    data.append(packed)
+        except TypeError:
+            # Not sent, keep the released references for the next request
+            self._released.extend(objs[0].pop('release', ()))
+            raise
+        futures = [] if oneway else \
+            [self._reader.expect(obj.get('id'), hold) for obj in objs]
+        if out_of_band:
+            # Array data is sent from the arrays, not copied into one buffer
+            for chunk in data:
+                self._socket.sendall(chunk)
+        else:
+            self._socket.sendall(b''.join(data))
+        return futures
 
     def _request(self, obj):
         """Make a request.
@@ -146,34 +378,799 @@ class Client:
             RemoteError: On remote request error.
             TypeError: On invalid response.
         """
-        with self._lock:
-            self._socket.sendall(self._packer.pack(obj))
-            obj = self._receive()
+        return self._result(self._send(obj)[0].result())
+
+    def _result(self, obj):
+        """Get the result of a response.
+
+        Args:
+            obj (dict): response
+
+        Returns:
+            object: returned value, or a tuple of items and whether the
+                iteration is done for an iterate request
+
+        Raises:
+            RemoteError: On remote request error.
+            TypeError: On invalid response.
+        """
         ret_type = obj['type']
         if ret_type == 'value':
+            if obj.get('references'):
+                return resolve(obj['value'], self._proxy)
             return obj['value']
         elif ret_type == 'reference':
-            value = obj['value']
-            return Proxy(self, value)
+            return self._proxy(Reference(obj['value'], obj.get('schema'),
+                                         obj.get('schema_def')))
+        elif ret_type == 'method':
+            return METHOD
+        elif ret_type == 'items':
+            items = obj['value']
+            if obj.get('references'):
+                items = resolve(items, self._proxy)
+            return items, obj['done']
         elif ret_type == 'error':
             raise RemoteError(obj['value'])
         raise TypeError('Invalid response.')
 
+    def _proxy(self, reference):
+        """Make the proxy of a reference.
+
+        Args:
+            reference (Reference): reference to a remote object
+
+        Returns:
+            Proxy: proxy, of the class of its schema if known
+        """
+        if not reference.schema_def is None:
+            self._proxy_types[reference.schema] = proxy_type(
+                reference.schema_def)
+        # A schema may not have arrived yet, if responses were reordered
+        cls = self._proxy_types.get(reference.schema, GenericProxy)
+        return cls(self, reference.instance)
+
+    def _release(self, reference):
+        """Release a reference without making its proxy, keeping the schema
+        it may carry.
+
+        Args:
+            reference (Reference): reference to a remote object
+        """
+        if not reference.schema_def is None:
+            self._proxy_types[reference.schema] = proxy_type(
+                reference.schema_def)
+        self._close(reference.instance)
+
     def factory(self, provider, *args, **kwargs):
         provider = provider.__name__ if isinstance(provider, type) else provider
         return self._open(provider, *args, **kwargs)
 
+    def submit(self, fn, *args, **kwargs):
+        """Call a remote method, without waiting for its result. Any number
+        of calls may be in flight, their futures complete as the responses
+        arrive:
+
+            futures = [client.submit(obj.method, x) for obj in objs]
+
+        Args:
+            fn (Method, callable): method of a Proxy, including special
+                methods, e.g. obj.__getitem__
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            Future: returned object
+
+        Raises:
+            TypeError: If fn is not a method of a Proxy of this client.
+        """
+        if isinstance(fn, Method):
+            proxy, name = fn._proxy, fn._name
+        else:
+            proxy, name = getattr(fn, '__self__', None), \
+                getattr(fn, '__name__', None)
+        if not isinstance(proxy, Proxy) or not proxy._cli is self:
+            raise TypeError('fn: Expected a method of a remote object of '
+                            'this client.')
+        return self._submit(proxy, name, *args, **kwargs)
+
+    def promise(self, provider, *args, **kwargs):
+        """Make a new instance, without waiting for it. Calls, attribute and
+        item lookups on the returned promise are pipelined:
+
+            value = client.promise('Db').table('x').row(5).value.result()
+
+        Args:
+            provider (str, type): provider name or type
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            Promise: promise of the new Proxy object
+        """
+        provider = provider.__name__ if isinstance(provider, type) else provider
+        return Promise(self, {
+            'action': 'open',
+            'provider': provider,
+            'args': args,
+            'kwargs': kwargs,
+        })
+
+    def pipeline(self, window=64):
+        """Make a pipeline, to send many requests without waiting for each
+        response.
+
+        Args:
+            window (int, optional): number of requests sent per write,
+                default 64
+
+        Returns:
+            Pipeline: new pipeline
+        """
+        return Pipeline(self, window)
+
+    def batch(self):
+        """Make a batch, to record method calls and send them in a single
+        request. Use as a context manager:
+
+            with client.batch():
+                futures = [obj.append(i) for i in range(100)]
+
+        Returns:
+            Batch: new batch
+        """
+        return Batch(self)
+
+
+class Pipeline:
+
+    def __init__(self, client, window=64):
+        """Requests queued to be sent back-to-back. The server executes and
+        responds to them in order, so a pipeline of N requests costs about
+        one round trip rather than N.
+
+        Args:
+            client (Client): client
+            window (int, optional): number of requests sent per write,
+                default 64
+        """
+        if window < 1:
+            raise ValueError('window: Expected at least 1.')
+        self._client = client
+        self._window = window
+        self._requests = []
+        # Proxies of the requests, kept until their responses arrive
+        self._proxies = []
+
+    def __len__(self):
+        return len(self._requests)
+
+    def execute(self, proxy, method, *args, **kwargs):
+        """Queue a method call.
+
+        Args:
+            proxy (Proxy): remote object
+            method (str): method name
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+        """
+        self._requests.append({
+            'action': 'execute',
+            'method': method,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        })
+        self._proxies.append(proxy)
+
+    def collect(self, raise_on_error=True):
+        """Send all queued requests and collect their results, in order.
+
+        Args:
+            raise_on_error (bool, optional): raise the first error once all
+                results are collected, default True. Otherwise, errors are
+                returned in place of their results.
+
+        Returns:
+            list: returned values
+
+        Raises:
+            RemoteError: On remote request error.
+        """
+        requests, self._requests = self._requests, []
+        proxies, self._proxies = self._proxies, []
+        futures = []
+        for i in range(0, len(requests), self._window):
+            futures.extend(self._client._send(
+                *requests[i:i + self._window], ordered=True,
+                hold=proxies[i:i + self._window]))
+        results = []
+        for future in futures:
+            try:
+                results.append(self._client._result(future.result()))
+            except RemoteError as ex:
+                results.append(ex)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, RemoteError):
+                    raise result
+        return results
+
+
+class Batch:
+
+    def __init__(self, client):
+        """Method calls recorded, rather than made, while the batch is
+        entered by the current thread. Each call returns a Future of its
+        result. On exit, the calls are sent in one request, the server makes
+        them in order and responds once. On error within the block, nothing
+        is sent.
+
+        Args:
+            client (Client): client
+        """
+        self._client = client
+        self._requests = []
+        self._futures = []
+        # Proxies of the calls, kept until the response arrives
+        self._proxies = []
+        self._previous = None
+
+    def __len__(self):
+        return len(self._requests)
+
+    def __enter__(self):
+        self._previous = getattr(self._client._local, 'batch', None)
+        self._client._local.batch = self
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self._client._local.batch = self._previous
+        if type_ is None:
+            self.send()
+        else:
+            for future in self._futures:
+                future.cancel()
+            self._requests, self._futures, self._proxies = [], [], []
+
+    @property
+    def futures(self):
+        """Futures of the recorded calls, in order.
+
+        Returns:
+            list: Futures
+        """
+        return list(self._futures)
+
+    def record(self, request, proxy):
+        """Record a request.
+
+        Args:
+            request (dict): request
+            proxy (Proxy): remote object of the request
+
+        Returns:
+            Future: result of the request
+        """
+        future = Future()
+        self._requests.append(request)
+        self._futures.append(future)
+        self._proxies.append(proxy)
+        return future
+
+    def send(self):
+        """Send the recorded requests and wait for their results."""
+        requests, self._requests = self._requests, []
+        futures, self._futures = self._futures, []
+        proxies, self._proxies = self._proxies, []
+        if not requests:
+            return
+        response = self._client._send({
+            'action': 'batch',
+            'requests': requests,
+        }, hold=proxies)[0].result()
+        if response['type'] == 'error':
+            raise RemoteError(response['value'])
+        for future, sub_response in zip(futures, response['value']):
+            try:
+                future.set_result(self._client._result(sub_response))
+            except RemoteError as ex:
+                future.set_exception(ex)
+
+
+class RemoteFuture(Future):
+
+    def __init__(self, client):
+        """Future of the result of a request, completed with its response by
+        the reader thread. The result is made from the response by the first
+        thread calling result(), as making it may make requests, e.g. to hash
+        proxies as dict keys, which the reader thread would wait for itself.
+        For the same reason, done callbacks called by the reader thread are
+        run on a thread of their own.
+
+        Args:
+            client (Client): client
+        """
+        super().__init__()
+        self._client = client
+        self._resolve_lock = Lock()
+        self._value = None
+        self._error = None
+
+    def __del__(self):
+        client = self.__dict__.get('_client')
+        if not client is None and self.done() and not self.cancelled():
+            # Never resolved, release the references of the response
+            _discard(client, super())
+
+    def add_done_callback(self, fn):
+        super().add_done_callback(lambda future: _callback(fn, future))
+
+    def result(self, timeout=None):
+        response = super().result(timeout)
+        with self._resolve_lock:
+            if not self._client is None:
+                client, self._client = self._client, None
+                try:
+                    self._value = client._result(response)
+                except Exception as ex:
+                    self._error = ex
+        if not self._error is None:
+            raise self._error
+        return self._value
+
+    def exception(self, timeout=None):
+        error = super().exception(timeout)
+        if error is None:
+            try:
+                self.result()
+            except Exception as ex:
+                return ex
+        return error
+
+
+class Reader(Thread):
+
+    def __init__(self, sock, unpacker):
+        """Thread receiving responses and routing them to the futures of
+        their requests. Responses with an 'id' complete the request with the
+        same 'id', responses without complete ordered requests in order.
+
+        Args:
+            sock (socket): connected socket
+            unpacker (msgpack.Unpacker): response unpacker
+        """
+        super().__init__(daemon=True)
+        self._socket = sock
+        self._unpacker = unpacker
+        self._lock = Lock()
+        self._closed = False
+        # Futures, and objects held until they complete, by [request id]
+        self._pending = {}
+        # Futures, and objects held until they complete, of ordered requests
+        self._ordered = deque()
+
+    def expect(self, request_id=None, hold=None):
+        """Expect a response.
+
+        Args:
+            request_id (int, optional): request id, default None for an
+                ordered request
+            hold (object, optional): kept until the response arrives
+
+        Returns:
+            Future: completed with the response
+
+        Raises:
+            ConnectionError: If the connection is closed.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise ConnectionError('Connection closed.')
+            if request_id is None:
+                self._ordered.append((future, hold))
+            else:
+                self._pending[request_id] = (future, hold)
+        return future
+
+    def run(self):
+        try:
+            while True:
+                for response in self._unpacker:
+                    response = check_decoded(response)
+                    for view in receive_buffers(self._unpacker):
+                        if not recv_into(self._socket, view):
+                            raise ConnectionError('Connection closed.')
+                    with self._lock:
+                        if 'id' in response:
+                            future, hold = self._pending.pop(response['id'],
+                                                             (None, None))
+                        else:
+                            future, hold = self._ordered.popleft()
+                    if not future is None:
+                        future.set_result(response)
+                # Do not keep the last response while blocked, its future's
+                # callbacks may hold references to be released
+                future = hold = response = None
+                chunk = self._socket.recv(1048576)
+                if not chunk:
+                    break
+                self._unpacker.feed(chunk)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._closed = True
+                futures = [future for future, _ in
+                           list(self._pending.values()) + list(self._ordered)]
+                self._pending.clear()
+                self._ordered.clear()
+            for future in futures:
+                future.set_exception(ConnectionError('Connection closed.'))
+
+
+class Iterator:
+
+    def __init__(self, proxy):
+        """Iterator over a remote iterator, fetching items in batches. The
+        batch size doubles from ITERATE_BATCH up to ITERATE_MAX_BATCH, and
+        the next batch is requested while the current one is consumed.
+
+        Args:
+            proxy (Proxy): remote iterator
+        """
+        self._proxy = proxy
+        self._batch = ITERATE_BATCH
+        self._items = deque()
+        self._future = self._fetch()
+
+    def __del__(self):
+        future = getattr(self, '_future', None)
+        if not future is None:
+            # Release the references of a batch never consumed
+            client = self._proxy._cli
+            future.add_done_callback(lambda future: _discard(client, future))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._items:
+            if self._future is None:
+                raise StopIteration
+            future, self._future = self._future, None
+            items, done = self._proxy._cli._result(future.result())
+            if not done:
+                self._future = self._fetch()
+            self._items.extend(items)
+            if not self._items:
+                raise StopIteration
+        return self._items.popleft()
+
+    def _fetch(self):
+        """Request the next batch.
+
+        Returns:
+            Future: completed with the response
+        """
+        future = self._proxy._cli._iterate(self._proxy._inst, self._batch)
+        self._batch = min(self._batch * 2, ITERATE_MAX_BATCH)
+        return future
+
+
+def _discard(client, future):
+    """Discard a response, releasing its references. No proxies are made of
+    them, as making them may make requests, e.g. to hash them as dict keys.
+
+    Args:
+        client (Client): client
+        future (Future): done future of the response
+    """
+    if not future.exception() is None:
+        return
+    response = future.result()
+    ret_type = response['type']
+    if ret_type == 'reference':
+        client._release(Reference(response['value'], response.get('schema'),
+                                  response.get('schema_def')))
+    elif ret_type in ('value', 'items') and response.get('references'):
+        resolve(response['value'], client._release)
+
+
+def _callback(fn, future):
+    """Call a done callback of a RemoteFuture, on a thread of its own if
+    called by a reader thread.
+
+    Args:
+        fn (callable): callback
+        future (RemoteFuture): done future
+    """
+    if isinstance(current_thread(), Reader):
+        Thread(target=fn, args=(future,), daemon=True).start()
+    else:
+        fn(future)
+
+
+class Flusher(Thread):
+
+    def __init__(self, interval):
+        """Thread sending the released references of clients, those of a
+        client once it notifies that enough are queued, those of all clients
+        every interval. One is shared by all clients, see flusher().
+
+        Args:
+            interval (float): seconds between sends
+        """
+        super().__init__(daemon=True)
+        # Weak, so clients can be garbage collected
+        self._clients = weakref.WeakSet()
+        # Weak references of notifying clients
+        self._notified = SimpleQueue()
+        self._interval = interval
+
+    def add(self, client):
+        """Send the released references of a client, until it is closed or
+        garbage collected.
+
+        Args:
+            client (Client): client
+        """
+        self._clients.add(client)
+
+    def notify(self, client):
+        """Send the released references of a client soon. Never blocks, so
+        it is safe from __del__.
+
+        Args:
+            client (Client): client
+        """
+        self._notified.put(weakref.ref(client))
+
+    def run(self):
+        deadline = time.monotonic() + self._interval
+        while True:
+            try:
+                clients = [self._notified.get(
+                    timeout=max(deadline - time.monotonic(), 0))()]
+            except Empty:
+                clients = list(self._clients)
+                deadline = time.monotonic() + self._interval
+            for client in clients:
+                # A client sending a request sends its released references
+                # with it, so a busy lock is skipped
+                if not client is None:
+                    client._flush(blocking=False)
+            clients = client = None
+
 
 class RemoteError(Exception):
     pass
 
 
+class Method:
+
+    def __init__(self, proxy, name):
+        """Method of a remote object. A call is a single execute request, no
+        reference to the bound method is made.
+
+        Args:
+            proxy (Proxy): remote object
+            name (str): method name
+        """
+        self._proxy = proxy
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        proxy = self._proxy
+        return proxy._execute(proxy, self._name, *args, **kwargs)
+
+    def __repr__(self):
+        return '<remote method {}>'.format(self._name)
+
+    def submit(self, *args, **kwargs):
+        """Call the method, without waiting for its result.
+
+        Args:
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            Future: returned object
+        """
+        proxy = self._proxy
+        return proxy._cli._submit(proxy, self._name, *args, **kwargs)
+
+    def oneway(self, *args, **kwargs):
+        """Call the method without a response. Calls are made in order, the
+        server logs their errors and discards their results.
+
+        Args:
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+        """
+        proxy = self._proxy
+        proxy._cli._oneway(proxy._inst, self._name, *args, **kwargs)
+
+    def promise(self, *args, **kwargs):
+        """Call the method, without waiting for its result. Unlike submit(),
+        further calls on the result are pipelined, see Promise.
+
+        Args:
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            Promise: promise of the returned object
+        """
+        proxy = self._proxy
+        return Promise(proxy._cli, {
+            'action': 'execute',
+            'method': self._name,
+            'instance': proxy._inst,
+            'args': args,
+            'kwargs': kwargs,
+        }, parent=proxy)
+
+
+class Promise:
+
+    def __init__(self, client, request=None, parent=None, name=None):
+        """Pending result of a request. Calls, attribute and item lookups on
+        a promise are sent at once, naming the promise rather than its
+        result, and the server makes them once the result is known. So a
+        chain of them costs about one round trip, only result() waits.
+
+        An attribute lookup is sent once it is used, other than by calling
+        it, which is sent as a method call of its parent instead.
+
+        Attributes of the promise itself, result() and its private helpers
+        (e.g. _send()), shadow remote attributes by the same name. These are
+        looked up with promise.__getattr__(name) instead.
+
+        Args:
+            client (Client): client
+            request (dict, optional): request to send
+            parent (Promise, Proxy, optional): object the request depends on,
+                kept until its result is known
+            name (str, optional): name of the attribute of parent looked up,
+                if request is None
+        """
+        self._client = client
+        self._parent = parent
+        self._name = name
+        self._future = None
+        self._id = None
+        self._done = False
+        self._value = None
+        if not request is None:
+            self._send(request)
+
+    def __del__(self):
+        future = self.__dict__.get('_future')
+        if not future is None and not self._done:
+            # Release the result once known, the parent is kept until then
+            client, parent = self._client, self._parent
+            future.add_done_callback(
+                lambda future, parent=parent: _discard(client, future))
+
+    def __repr__(self):
+        return '<promise {}>'.format(self._id)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return Promise(self._client, parent=self, name=name)
+
+    def __call__(self, *args, **kwargs):
+        if self._future is None:
+            return self._parent._then(self._name, args, kwargs)
+        return self._then('__call__', args, kwargs)
+
+    def __getitem__(self, key):
+        return self._then('__getitem__', (key,), {})
+
+    def result(self, timeout=None):
+        """Wait for the result.
+
+        Args:
+            timeout (float, optional): seconds to wait, default None to wait
+                forever
+
+        Returns:
+            object: returned object
+
+        Raises:
+            RemoteError: On remote request error.
+            TimeoutError: If not done within timeout.
+        """
+        if not self._done:
+            self._request_id()
+            ret = self._client._result(self._future.result(timeout))
+            if ret is METHOD:
+                ret = Method(self._parent.result(), self._name)
+            self._value = ret
+            self._done = True
+            self._parent = None
+        return self._value
+
+    def _send(self, request):
+        """Send the request, holding its result as a promise.
+
+        Args:
+            request (dict): request
+        """
+        request['hold'] = True
+        self._future = self._client._send(request)[0]
+        self._id = request['id']
+
+    def _request_id(self):
+        """Get the request id, sending a pending attribute lookup.
+
+        Returns:
+            int: request id
+        """
+        if self._future is None:
+            self._send({
+                'action': 'execute',
+                'method': '__getattr__',
+                'promise': self._parent._request_id(),
+                'args': (self._name,),
+                'kwargs': {},
+            })
+        return self._id
+
+    def _then(self, method, args, kwargs):
+        """Call a method of the result.
+
+        Args:
+            method (str): method name
+            args (tuple): positional arguments
+            kwargs (dict): keyword arguments
+
+        Returns:
+            Promise: promise of the returned object
+        """
+        return Promise(self._client, {
+            'action': 'execute',
+            'method': method,
+            'promise': self._request_id(),
+            'args': args,
+            'kwargs': kwargs,
+        }, parent=self)
+
+
+class MethodDescriptor:
+
+    def __init__(self, name):
+        """Method attribute of a proxy class, resolved without a request.
+
+        Args:
+            name (str): method name
+        """
+        self._name = name
+
+    def __get__(self, proxy, owner=None):
+        if proxy is None:
+            return self
+        return Method(proxy, self._name)
+
+
+# Result of __getattr__ for a method, see Proxy.__getattr__
+METHOD = object()
+
+
 class Proxy:
+    """Base of proxy classes, supporting attribute access. Proxy classes made
+    by proxy_type() add the methods and operations of their remote type.
+    """
 
     def __init__(self, client, instance):
         super(Proxy, self).__setattr__('_cli', client)
         super(Proxy, self).__setattr__('_execute', client._execute)
         super(Proxy, self).__setattr__('_inst', instance)
+        # Names of attributes known to be methods
+        super(Proxy, self).__setattr__('_methods', set())
 
     ## Basic
 
@@ -181,180 +1178,276 @@ class Proxy:
         if self._cli.is_open:
             self._cli._close(self._inst)
 
+    ## Attribute access
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            return Method(self, name)
+        ret = self._execute(self, '__getattr__', name)
+        if ret is METHOD:
+            self._methods.add(name)
+            return Method(self, name)
+        return ret
+
+    def __setattr__(self, name, value):
+        self._execute(self, '__setattr__', name, value)
+
+    def __delattr__(self, name):
+        self._execute(self, '__delattr__', name)
+
+
+class GenericProxy(Proxy):
+    """Proxy of a remote object of unknown type, supporting all operations."""
+
+    ## Basic
+
     def __repr__(self):
-        return self._execute(self._inst, '__repr__')
+        return self._execute(self, '__repr__')
 
     def __str__(self):
-        return self._execute(self._inst, '__str__')
+        return self._execute(self, '__str__')
 
     def __bytes__(self):
-        return self._execute(self._inst, '__bytes__')
+        return self._execute(self, '__bytes__')
 
     def __format__(self, format_spec):
-        return self._execute(self._inst, '__format__', format_spec)
+        return self._execute(self, '__format__', format_spec)
 
     def __lt__(self, other):
-        return self._execute(self._inst, '__lt__', other)
+        return self._execute(self, '__lt__', other)
 
     def __le__(self, other):
-        return self._execute(self._inst, '__le__', other)
+        return self._execute(self, '__le__', other)
 
     def __eq__(self, other):
-        return self._execute(self._inst, '__eq__', other)
+        return self._execute(self, '__eq__', other)
 
     def __ne__(self, other):
-        return self._execute(self._inst, '__ne__', other)
+        return self._execute(self, '__ne__', other)
 
     def __gt__(self, other):
-        return self._execute(self._inst, '__gt__', other)
+        return self._execute(self, '__gt__', other)
 
     def __ge__(self, other):
-        return self._execute(self._inst, '__ge__', other)
+        return self._execute(self, '__ge__', other)
 
     def __hash__(self):
-        return self._execute(self._inst, '__hash__')
+        return self._execute(self, '__hash__')
 
     def __bool__(self):
-        return self._execute(self._inst, '__bool__')
-
-    ## Attribute access
-
-    def __getattr__(self, name):
-        return self._execute(self._inst, '__getattr__', name)
-
-    def __setattr__(self, name, value):
-        self._execute(self._inst, '__setattr__', name, value)
-
-    def __delattr__(self, name):
-        self._execute(self._inst, '__delattr__', name)
+        return self._execute(self, '__bool__')
 
     def __dir__(self):
-        return self._execute(self._inst, '__dir__')
+        return self._execute(self, '__dir__')
 
     ## Callable
 
     def __call__(self, *args, **kwargs):
-        return self._execute(self._inst, '__call__', *args, **kwargs)
+        return self._execute(self, '__call__', *args, **kwargs)
 
     ## Container
 
     def __len__(self):
-        return self._execute(self._inst, '__len__')
+        return self._execute(self, '__len__')
 
     def __length_hint__(self):
-        return self._execute(self._inst, '__length_hint__')
+        return self._execute(self, '__length_hint__')
 
     def __getitem__(self, key):
-        return self._execute(self._inst, '__getitem__', key)
+        return self._execute(self, '__getitem__', key)
 
     def __missing__(self, key):
-        return self._execute(self._inst, '__missing__', key)
+        return self._execute(self, '__missing__', key)
 
     def __setitem__(self, key, value):
-        return self._execute(self._inst, '__setitem__', key, value)
+        return self._execute(self, '__setitem__', key, value)
 
     def __delitem__(self, key):
-        return self._execute(self._inst, '__delitem__', key)
+        return self._execute(self, '__delitem__', key)
 
     def __iter__(self):
-        return self._execute(self._inst, '__iter__')
+        return Iterator(self._execute(self, '__iter__'))
+
+    def __next__(self):
+        items, done = self._cli._result(
+            self._cli._iterate(self._inst, 1).result())
+        if not items:
+            raise StopIteration
+        return items[0]
 
     def __reversed__(self):
-        return self._execute(self._inst, '__reversed__')
+        return self._execute(self, '__reversed__')
 
     def __contains__(self, item):
-        return self._execute(self._inst, '__contains__', item)
+        return self._execute(self, '__contains__', item)
 
     ## Context managers
 
     def __enter__(self):
-        return self._execute(self._inst, '__enter__')
+        return self._execute(self, '__enter__')
 
     def __exit__(self, type_, value, traceback):
-        return self._execute(self._inst, '__exit__', type_, value, traceback)
+        return self._execute(self, '__exit__', *exit_args(type_, value))
 
     ## Numeric
 
     def __add__(self, other):
-        return self._execute(self._inst, '__add__', other)
+        return self._execute(self, '__add__', other)
 
     def __sub__(self, other):
-        return self._execute(self._inst, '__sub__', other)
+        return self._execute(self, '__sub__', other)
 
     def __mul__(self, other):
-        return self._execute(self._inst, '__mul__', other)
+        return self._execute(self, '__mul__', other)
 
     def __matmul__(self, other):
-        return self._execute(self._inst, '__matmul__', other)
+        return self._execute(self, '__matmul__', other)
 
     def __truediv__(self, other):
-        return self._execute(self._inst, '__truediv__', other)
+        return self._execute(self, '__truediv__', other)
 
     def __floordiv__(self, other):
-        return self._execute(self._inst, '__floordiv__', other)
+        return self._execute(self, '__floordiv__', other)
 
     def __mod__(self, other):
-        return self._execute(self._inst, '__mod__', other)
+        return self._execute(self, '__mod__', other)
 
     def __divmod__(self, other):
-        return self._execute(self._inst, '__divmod__', other)
+        return self._execute(self, '__divmod__', other)
 
     def __pow__(self, other, *args, **kwargs):
-        return self._execute(self._inst, '__pow__', other, *args, **kwargs)
+        return self._execute(self, '__pow__', other, *args, **kwargs)
 
     def __lshift__(self, other):
-        return self._execute(self._inst, '__lshift__', other)
+        return self._execute(self, '__lshift__', other)
 
     def __rshift__(self, other):
-        return self._execute(self._inst, '__rshift__', other)
+        return self._execute(self, '__rshift__', other)
 
     def __and__(self, other):
-        return self._execute(self._inst, '__and__', other)
+        return self._execute(self, '__and__', other)
 
     def __xor__(self, other):
-        return self._execute(self._inst, '__xor__', other)
+        return self._execute(self, '__xor__', other)
 
     def __or__(self, other):
-        return self._execute(self._inst, '__or__', other)
+        return self._execute(self, '__or__', other)
 
     def __radd__(self, other):
-        return self._execute(self._inst, '__radd__', other)
+        return self._execute(self, '__radd__', other)
 
     def __rsub__(self, other):
-        return self._execute(self._inst, '__rsub__', other)
+        return self._execute(self, '__rsub__', other)
 
     def __rmul__(self, other):
-        return self._execute(self._inst, '__rmul__', other)
+        return self._execute(self, '__rmul__', other)
 
     def __rmatmul__(self, other):
-        return self._execute(self._inst, '__rmatmul__', other)
+        return self._execute(self, '__rmatmul__', other)
 
     def __rtruediv__(self, other):
-        return self._execute(self._inst, '__rtruediv__', other)
+        return self._execute(self, '__rtruediv__', other)
 
     def __rfloordiv__(self, other):
-        return self._execute(self._inst, '__rfloordiv__', other)
+        return self._execute(self, '__rfloordiv__', other)
 
     def __rmod__(self, other):
-        return self._execute(self._inst, '__rmod__', other)
+        return self._execute(self, '__rmod__', other)
 
     def __rdivmod__(self, other):
-        return self._execute(self._inst, '__rdivmod__', other)
+        return self._execute(self, '__rdivmod__', other)
 
     def __rpow__(self, other, *args, **kwargs):
-        return self._execute(self._inst, '__rpow__', other, *args, **kwargs)
+        return self._execute(self, '__rpow__', other, *args, **kwargs)
 
     def __rlshift__(self, other):
-        return self._execute(self._inst, '__rlshift__', other)
+        return self._execute(self, '__rlshift__', other)
 
     def __rrshift__(self, other):
-        return self._execute(self._inst, '__rrshift__', other)
+        return self._execute(self, '__rrshift__', other)
 
     def __rand__(self, other):
-        return self._execute(self._inst, '__rand__', other)
+        return self._execute(self, '__rand__', other)
 
     def __rxor__(self, other):
-        return self._execute(self._inst, '__rxor__', other)
+        return self._execute(self, '__rxor__', other)
 
     def __ror__(self, other):
-        return self._execute(self._inst, '__ror__', other)
+        return self._execute(self, '__ror__', other)
+
+
+# Operations a proxy class may support, by [special method name]
+OPERATIONS = {name: attr for name, attr in vars(GenericProxy).items()
+              if name.startswith('__') and callable(attr)}
+
+
+def exit_args(type_, value):
+    """Get the arguments of a remote __exit__() call. Exceptions are not
+    sent, their type name and message are passed in place of their type and
+    value, so a failure is told from success.
+
+    Args:
+        type_ (type): exception type, or None
+        value (BaseException): exception, or None
+
+    Returns:
+        tuple: type name, message and traceback None, or all None
+    """
+    if type_ is None:
+        return None, None, None
+    return type_.__name__, str(value), None
+
+
+def check_decoded(response):
+    """Check that the ext types of a response just unpacked decoded. Call
+    it in the thread that unpacked it.
+
+    Args:
+        response (dict): response
+
+    Returns:
+        dict: response, or an error response in its place
+    """
+    error = decode_error()
+    if error is None:
+        return response
+    failed = {'type': 'error',
+              'value': 'Could not decode response.\n{}'.format(error)}
+    if 'id' in response:
+        failed['id'] = response['id']
+    return failed
+
+
+def proxy_type(schema):
+    """Make a proxy class for a remote type. Its methods are known, so
+    looking them up takes no request, and operations the type does not
+    support fail locally.
+
+    Args:
+        schema (dict): schema of the remote type
+
+    Returns:
+        type: subclass of Proxy
+    """
+    attrs = {name: OPERATIONS[name] for name in schema['dunders']
+             if name in OPERATIONS}
+    for name in schema['methods']:
+        # Instance attributes of Proxy take precedence, so skip their names
+        if not name in ('_cli', '_execute', '_inst', '_methods'):
+            attrs[name] = MethodDescriptor(name)
+    return type(schema['name'], (Proxy,), attrs)
+
+
+def flusher():
+    """Get the flusher shared by all clients of the process, started once
+    needed, also anew in a forked process.
+
+    Returns:
+        Flusher: flusher
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = Flusher(RELEASE_INTERVAL)
+            _flusher.start()
+        return _flusher
@@ -0,0 +1,477 @@
+from decimal import Decimal
+from threading import Lock, local
+from uuid import UUID
+import datetime
+import traceback
+import msgpack
+try:
+    import numpy
+except ImportError:
+    # numpy is optional
+    numpy = None
+
+
+# msgpack ext type codes, codes below EXT_USER are reserved
+EXT_REFERENCE = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+EXT_TIME = 4
+EXT_TIMEDELTA = 5
+EXT_DECIMAL = 6
+EXT_UUID = 7
+EXT_SET = 8
+EXT_FROZENSET = 9
+EXT_COMPLEX = 10
+EXT_NDARRAY = 11
+EXT_NDSCALAR = 12
+EXT_USER = 32
+
+# Types msgpack packs itself, scalars and containers
+SCALARS = (type(None), bool, int, float, str, bytes, bytearray, memoryview)
+CONTAINERS = (list, tuple, dict)
+
+
+class Reference:
+
+    __slots__ = ('instance', 'schema', 'schema_def')
+
+    def __init__(self, instance, schema=None, schema_def=None):
+        """Reference to a remote object, as decoded from its ext type, to be
+        resolved to the object by the server, or to a proxy by the client.
+
+        Args:
+            instance (int, str): instance id
+            schema (int, optional): schema id of the object's type
+            schema_def (dict, optional): schema, if not sent before
+        """
+        self.instance = instance
+        self.schema = schema
+        self.schema_def = schema_def
+
+    def __eq__(self, other):
+        return isinstance(other, Reference) and other.instance == self.instance
+
+    def __hash__(self):
+        return hash(self.instance)
+
+    def __repr__(self):
+        return 'Reference({!r})'.format(self.instance)
+
+
+class Codecs:
+
+    def __init__(self):
+        """Registry of codecs, which pack objects of types msgpack can not
+        pack as ext types, so they travel by value rather than by reference.
+        """
+        self._lock = Lock()
+        # Ext type code and encode function by [type]
+        self._types = {}
+        # Decode functions by [ext type code]
+        self._decoders = {}
+        # Codec of each type packed, or None, by [type]
+        self._cache = {}
+        # Packability by [type], see packable()
+        self._packable = {}
+
+    def register(self, cls, code, encode, decode):
+        """Register a codec.
+
+        Args:
+            cls (type): type, including subclasses
+            code (int): ext type code
+            encode (callable): returns the bytes of an object
+            decode (callable): returns the object of bytes
+        """
+        if not 0 <= code <= 127:
+            raise ValueError('code: Expected 0 to 127.')
+        with self._lock:
+            if code in self._decoders:
+                raise KeyError('A codec by code {} already exists.'.format(
+                    code))
+            self._types[cls] = (code, encode)
+            self._decoders[code] = decode
+            self._cache = {}
+            self._packable = {}
+
+    def default(self, obj):
+        """Pack an object msgpack can not pack, a packer's default.
+
+        Args:
+            obj (object): object
+
+        Returns:
+            msgpack.ExtType: ext type
+
+        Raises:
+            TypeError: If no codec is registered for the object's type.
+        """
+        cls = type(obj)
+        try:
+            codec = self._cache[cls]
+        except KeyError:
+            codec = self._cache[cls] = next(
+                (self._types[base] for base in cls.__mro__
+                 if base in self._types), None)
+        if codec is None:
+            raise TypeError('Can not serialize {!r}.'.format(cls))
+        return msgpack.ExtType(codec[0], codec[1](obj))
+
+    def packable(self, cls):
+        """Can objects of a type be packed? Cached per type.
+
+        Args:
+            cls (type): type
+
+        Returns:
+            bool: True for scalars msgpack packs and types with a codec,
+                False for other types, None for containers, which depend
+                on their items
+        """
+        try:
+            return self._packable[cls]
+        except KeyError:
+            pass
+        packable = False
+        for base in cls.__mro__:
+            if base in SCALARS or base in self._types:
+                packable = True
+                break
+            if base in CONTAINERS:
+                packable = None
+                break
+        self._packable[cls] = packable
+        return packable
+
+    def ext_hook(self, code, data):
+        """Unpack an ext type, an unpacker's ext_hook.
+
+        Args:
+            code (int): ext type code
+            data (bytes): ext type data
+
+        Returns:
+            object: object, or the ext type if no codec is registered
+        """
+        decode = self._decoders.get(code)
+        if decode is None:
+            return msgpack.ExtType(code, data)
+        return decode(data)
+
+
+def _pack(obj):
+    """Pack the contents of an ext type, with codecs."""
+    return msgpack.packb(obj, use_bin_type=True, default=CODECS.default)
+
+
+def _unpack(data, use_list=True):
+    """Unpack the contents of an ext type, with codecs."""
+    return msgpack.unpackb(data, raw=False, use_list=use_list,
+                           ext_hook=CODECS.ext_hook)
+
+
+# Codecs shared by Server and Client
+CODECS = Codecs()
+for _args in (
+        (datetime.datetime, EXT_DATETIME,
+         lambda obj: obj.isoformat().encode(),
+         lambda data: datetime.datetime.fromisoformat(data.decode())),
+        (datetime.date, EXT_DATE,
+         lambda obj: obj.isoformat().encode(),
+         lambda data: datetime.date.fromisoformat(data.decode())),
+        (datetime.time, EXT_TIME,
+         lambda obj: obj.isoformat().encode(),
+         lambda data: datetime.time.fromisoformat(data.decode())),
+        (datetime.timedelta, EXT_TIMEDELTA,
+         lambda obj: _pack((obj.days, obj.seconds, obj.microseconds)),
+         lambda data: datetime.timedelta(*_unpack(data))),
+        (Decimal, EXT_DECIMAL,
+         lambda obj: str(obj).encode(),
+         lambda data: Decimal(data.decode())),
+        (UUID, EXT_UUID,
+         lambda obj: obj.bytes,
+         lambda data: UUID(bytes=data)),
+        (set, EXT_SET,
+         lambda obj: _pack(list(obj)),
+         lambda data: set(_unpack(data, use_list=False))),
+        (frozenset, EXT_FROZENSET,
+         lambda obj: _pack(list(obj)),
+         lambda data: frozenset(_unpack(data, use_list=False))),
+        (complex, EXT_COMPLEX,
+         lambda obj: _pack((obj.real, obj.imag)),
+         lambda data: complex(*_unpack(data)))):
+    CODECS.register(*_args)
+del _args
+
+
+# Out-of-band buffers and decode errors of the current thread, see
+# pack_buffers() and decode_error()
+_local = local()
+
+
+def _encode_array(array, out_of_band=True):
+    """Encode an array as its dtype and shape, followed by its data unless
+    packed by pack_buffers(), which sends the data out of band. Scalars are
+    always sent in band, as their value is taken as soon as decoded."""
+    if array.dtype.hasobject or not array.dtype.fields is None:
+        raise TypeError('Can not serialize arrays of dtype {}.'.format(
+            array.dtype))
+    shape = array.shape
+    if not array.flags.c_contiguous:
+        array = numpy.ascontiguousarray(array)
+    buffers = getattr(_local, 'buffers', None) if out_of_band else None
+    header = _pack((array.dtype.str, shape, not buffers is None))
+    if buffers is None:
+        return header + array.tobytes()
+    buffers.append(_bytes_of(array))
+    return header
+
+
+def _decode_array(data):
+    """Decode an array. The data of an array sent out of band is received
+    into it later, see receive_buffers()."""
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(data)
+    dtype, shape, out_of_band = unpacker.unpack()
+    array = numpy.empty(shape, dtype=dtype)
+    view = _bytes_of(array)
+    if out_of_band:
+        if getattr(_local, 'received', None) is None:
+            _local.received = []
+        _local.received.append(view)
+    else:
+        view[:] = memoryview(data)[unpacker.tell():]
+    return array
+
+
+def _bytes_of(array):
+    """Get the memory of a contiguous array as bytes."""
+    return memoryview(array.reshape(-1).view(numpy.uint8))
+
+
+if not numpy is None:
+    CODECS.register(numpy.ndarray, EXT_NDARRAY, _encode_array, _decode_array)
+    CODECS.register(
+        numpy.generic, EXT_NDSCALAR,
+        lambda obj: _encode_array(numpy.asarray(obj), out_of_band=False),
+        lambda data: _decode_array(data)[()])
+
+
+def register_codec(cls, code, encode, decode):
+    """Register a codec for a type, for both Server and Client. Objects of
+    the type are then passed by value, as a msgpack ext type. Register the
+    same codec on both ends.
+
+    Args:
+        cls (type): type, including subclasses
+        code (int): ext type code, from 32 to 127
+        encode (callable): returns the bytes of an object
+        decode (callable): returns the object of bytes
+    """
+    if code < EXT_USER:
+        raise ValueError('code: Codes below {} are reserved.'.format(EXT_USER))
+    CODECS.register(cls, code, encode, decode)
+
+
+def encode_reference(instance, schema=None, schema_def=None):
+    """Encode a reference to a remote object.
+
+    Args:
+        instance (int, str): instance id
+        schema (int, optional): schema id of the object's type, for a
+            reference sent to a client
+        schema_def (dict, optional): schema, if not sent before
+
+    Returns:
+        msgpack.ExtType: reference ext type
+    """
+    if schema is None:
+        data = msgpack.packb(instance)
+    else:
+        data = msgpack.packb([instance, schema, schema_def])
+    return msgpack.ExtType(EXT_REFERENCE, data)
+
+
+def decode_reference(data):
+    """Decode a reference to a remote object.
+
+    Args:
+        data (bytes): data of a reference ext type
+
+    Returns:
+        Reference: reference
+    """
+    reference = msgpack.unpackb(data, raw=False)
+    if isinstance(reference, list):
+        return Reference(*reference)
+    return Reference(reference)
+
+
+def ext_hook(code, data):
+    """Unpack an ext type, references to remote objects as Reference, other
+    ext types with the registered codecs. An unpacker's ext_hook.
+
+    Args:
+        code (int): ext type code
+        data (bytes): ext type data
+
+    Returns:
+        object: object, None if it fails to decode, see decode_error()
+    """
+    try:
+        if code == EXT_REFERENCE:
+            return decode_reference(data)
+        return CODECS.ext_hook(code, data)
+    except Exception:
+        # Raised, the error would leave the unpacker's stream broken
+        if getattr(_local, 'decode_error', None) is None:
+            _local.decode_error = traceback.format_exc()
+        return None
+
+
+def decode_error():
+    """Get the error of the ext types of the object just unpacked that
+    failed to decode, if any. Call it in the thread that unpacked it, after
+    each object.
+
+    Returns:
+        str: traceback of the first error, or None
+    """
+    error = getattr(_local, 'decode_error', None)
+    _local.decode_error = None
+    return error
+
+
+def resolve(obj, lookup):
+    """Replace the references within an object, including those nested in
+    lists and dicts.
+
+    Args:
+        obj (object): decoded object
+        lookup (callable): returns the object of a Reference
+
+    Returns:
+        object: object with references replaced
+    """
+    if isinstance(obj, Reference):
+        return lookup(obj)
+    elif isinstance(obj, list):
+        return [resolve(item, lookup) for item in obj]
+    elif isinstance(obj, dict):
+        return {resolve(key, lookup): resolve(value, lookup)
+                for key, value in obj.items()}
+    return obj
+
+
+def pack_buffers(packer, obj):
+    """Pack an object, with the data of its arrays out of band. The data is
+    not copied into the packed object, it is to be sent as is right after
+    it, and received straight into the decoded arrays with
+    receive_buffers().
+
+    Args:
+        packer (msgpack.Packer): packer
+        obj (object): object
+
+    Returns:
+        bytes, list: packed object, or a list of it followed by the data
+            of its arrays
+    """
+    _local.buffers = buffers = []
+    try:
+        data = packer.pack(obj)
+    finally:
+        _local.buffers = None
+    if buffers:
+        return [data] + buffers
+    return data
+
+
+def receive_buffers(unpacker):
+    """Receive the data of the arrays of the objects just unpacked, sent
+    out of band after each, from the data the unpacker holds. Call it in the
+    thread that unpacked them, after each object.
+
+    Args:
+        unpacker (msgpack.Unpacker): unpacker
+
+    Returns:
+        list: memoryview of the data still to be received into each array
+            from the stream, in order
+    """
+    received = getattr(_local, 'received', None)
+    if not received:
+        return []
+    _local.received = None
+    pending = []
+    for view in received:
+        data = unpacker.read_bytes(len(view))
+        view[:len(data)] = data
+        if len(data) < len(view):
+            pending.append(view[len(data):])
+    return pending
+
+
+def recv_into(sock, view):
+    """Receive exactly the size of a buffer from a socket into it.
+
+    Args:
+        sock (socket): connected socket
+        view (memoryview): buffer
+
+    Returns:
+        bool: False if the connection was closed first
+    """
+    while len(view):
+        size = sock.recv_into(view)
+        if not size:
+            return False
+        view = view[size:]
+    return True
+
+
+def new_packer(default=None):
+    """Make a packer.
+
+    Args:
+        default (callable, optional): converts objects msgpack can not pack,
+            e.g. to an ext type
+
+    Returns:
+        msgpack.Packer: packer
+    """
+    return msgpack.Packer(use_bin_type=True, default=default)
+
+
+def new_unpacker(ext_hook=None):
+    """Make an unpacker.
+
+    For backwards compatibility, try these kwargs in order, until one succeeds.
+    * 'encoding' and 'unicode_errors' options are deprecated. There is new 'raw' option.
+      It is True by default for backward compatibility, but it is changed to False in
+      near future. You can use raw=False instead of encoding='utf-8'.
+    * For backwards compatibility, set 'max_buffer_size' explicitly.
+    * For backwards compatibility, set 'strict_map_key' to False explicitly, when possible.
+
+    Args:
+        ext_hook (callable, optional): decodes ext types, called with the
+            code and data
+
+    Returns:
+        msgpack.Unpacker: unpacker
+    """
+    kwargs_list = (
+        {'strict_map_key': False, 'raw': False},
+        {'raw': False},
+        {'encoding': 'utf-8'},
+    )
+    if not ext_hook is None:
+        kwargs_list = [dict(kwargs, ext_hook=ext_hook)
+                       for kwargs in kwargs_list]
+    for kwargs in kwargs_list:
+        try:
+            return msgpack.Unpacker(
+                use_list=True, max_buffer_size=2**31-1, **kwargs)
+        except TypeError:
+            continue
+    raise RuntimeError('Failed to create unpacker.')
@@ -0,0 +1,282 @@
+from collections import deque
+from threading import Condition, Lock
+import errno
+import socket
+
+
+# Bytes queued in each direction before a writer waits for the reader
+PIPE_SIZE = 2**22
+
+# Listeners by [name]
+_listeners = {}
+_listeners_lock = Lock()
+
+
+class Pipe:
+
+    def __init__(self, size=PIPE_SIZE):
+        """Queue of data sent one way between threads, the data of each
+        send queued as is. Writers wait while the queue is full.
+
+        Args:
+            size (int, optional): bytes queued before writers wait, default
+                PIPE_SIZE. Data larger is queued once the queue is empty.
+        """
+        lock = Lock()
+        self._readable = Condition(lock)
+        self._writable = Condition(lock)
+        self._size = size
+        self._chunks = deque()
+        self._queued = 0
+        # No more data is written
+        self._eof = False
+        # No more data is read
+        self._closed = False
+
+    def write(self, data):
+        """Queue data, waiting for room.
+
+        Args:
+            data (bytes-like): data, copied unless bytes
+
+        Raises:
+            BrokenPipeError: If the reading end is closed.
+        """
+        data = bytes(data)
+        with self._writable:
+            while self._queued and self._queued + len(data) > self._size \
+                    and not (self._closed or self._eof):
+                self._writable.wait()
+            if self._closed or self._eof:
+                raise BrokenPipeError(errno.EPIPE, 'Connection closed.')
+            if data:
+                self._chunks.append(data)
+                self._queued += len(data)
+                self._readable.notify()
+
+    def read(self, size):
+        """Dequeue up to size bytes, waiting for data.
+
+        Args:
+            size (int): maximum bytes
+
+        Returns:
+            bytes: data, empty once the writing end is closed and all data
+                read, or the reading end is closed
+        """
+        return bytes(self._read(size))
+
+    def read_into(self, view):
+        """Dequeue up to the size of a buffer into it, waiting for data.
+
+        Args:
+            view (memoryview): buffer
+
+        Returns:
+            int: bytes read, 0 once the writing end is closed and all data
+                read, or the reading end is closed
+        """
+        chunk = self._read(len(view))
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def _read(self, size):
+        with self._readable:
+            while not self._chunks:
+                if self._closed or self._eof:
+                    return b''
+                self._readable.wait()
+            chunk = self._chunks.popleft()
+            if len(chunk) > size:
+                # The rest is read from the same data, not a copy
+                chunk = memoryview(chunk)
+                self._chunks.appendleft(chunk[size:])
+                chunk = chunk[:size]
+            self._queued -= len(chunk)
+            self._writable.notify()
+            return chunk
+
+    def close_write(self):
+        """Close the writing end. Data queued may still be read."""
+        with self._readable:
+            self._eof = True
+            self._readable.notify_all()
+            self._writable.notify_all()
+
+    def close_read(self):
+        """Close the reading end, discarding data queued."""
+        with self._readable:
+            self._closed = True
+            self._chunks.clear()
+            self._queued = 0
+            self._readable.notify_all()
+            self._writable.notify_all()
+
+
+class Connection:
+
+    def __init__(self, send, receive):
+        """End of a connection between threads of one process. Supports the
+        socket methods clients and servers use.
+
+        Args:
+            send (Pipe): pipe this end writes
+            receive (Pipe): pipe this end reads
+        """
+        self._send = send
+        self._receive = receive
+
+    @classmethod
+    def pair(cls):
+        """Make both ends of a connection.
+
+        Returns:
+            tuple: the two ends
+        """
+        first, second = Pipe(), Pipe()
+        return cls(first, second), cls(second, first)
+
+    def sendall(self, data):
+        """Send all data.
+
+        Args:
+            data (bytes-like): data
+
+        Raises:
+            ConnectionError: If the connection is closed.
+        """
+        self._send.write(data)
+
+    def recv(self, size):
+        """Receive data.
+
+        Args:
+            size (int): maximum bytes
+
+        Returns:
+            bytes: data, empty once the connection is closed
+        """
+        return self._receive.read(size)
+
+    def recv_into(self, view):
+        """Receive data into a buffer.
+
+        Args:
+            view (memoryview): buffer
+
+        Returns:
+            int: bytes received, 0 once the connection is closed
+        """
+        return self._receive.read_into(view)
+
+    def shutdown(self, how):
+        """Shut down receiving, sending or both.
+
+        Args:
+            how (int): socket.SHUT_RD, SHUT_WR or SHUT_RDWR
+        """
+        if how in (socket.SHUT_RD, socket.SHUT_RDWR):
+            self._receive.close_read()
+        if how in (socket.SHUT_WR, socket.SHUT_RDWR):
+            self._send.close_write()
+
+    def close(self):
+        """Close the connection."""
+        self.shutdown(socket.SHUT_RDWR)
+
+
+class Listener:
+
+    def __init__(self, name):
+        """Listener for connections from threads of this process, by name.
+        Supports the socket methods servers use, its file descriptor is
+        readable while connections are waiting to be accepted.
+
+        Args:
+            name (str): name connected to
+
+        Raises:
+            OSError: If a listener by the name already exists.
+        """
+        self._name = name
+        self._lock = Lock()
+        self._waiting = deque()
+        # Holds a byte while connections are waiting, so selectors tell
+        # when to accept
+        self._wakeup, self._wakeup_write = socket.socketpair()
+        self._wakeup.setblocking(False)
+        with _listeners_lock:
+            exists = name in _listeners
+            if not exists:
+                _listeners[name] = self
+        if exists:
+            self._wakeup.close()
+            self._wakeup_write.close()
+            raise OSError(errno.EADDRINUSE,
+                          'Name \'{}\' already in use.'.format(name))
+
+    def fileno(self):
+        return self._wakeup.fileno()
+
+    def getsockname(self):
+        return self._name
+
+    def setblocking(self, flag):
+        """Accepting never blocks."""
+
+    def accept(self):
+        """Accept a connection.
+
+        Returns:
+            tuple: connection and the name connected to
+
+        Raises:
+            BlockingIOError: If no connection is waiting.
+        """
+        with self._lock:
+            if not self._waiting:
+                raise BlockingIOError(errno.EAGAIN, 'No connection waiting.')
+            conn = self._waiting.popleft()
+            if not self._waiting:
+                self._wakeup.recv(1)
+        return conn, self._name
+
+    def close(self):
+        """Stop listening, closing connections not yet accepted."""
+        with _listeners_lock:
+            if _listeners.get(self._name) is self:
+                del _listeners[self._name]
+        with self._lock:
+            while self._waiting:
+                self._waiting.popleft().close()
+        self._wakeup.close()
+        self._wakeup_write.close()
+
+    def _connect(self):
+        client, server = Connection.pair()
+        with self._lock:
+            self._waiting.append(server)
+            if len(self._waiting) == 1:
+                self._wakeup_write.send(b'\0')
+        return client
+
+
+def connect(name):
+    """Connect to a listener of this process.
+
+    Args:
+        name (str): name of the listener
+
+    Returns:
+        Connection: client end of the connection
+
+    Raises:
+        ConnectionRefusedError: If no listener by the name exists.
+    """
+    with _listeners_lock:
+        listener = _listeners.get(name)
+        if listener is None:
+            raise ConnectionRefusedError(
+                errno.ECONNREFUSED,
+                'No listener by name \'{}\'.'.format(name))
+        return listener._connect()
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+
+from ..codec import receive_buffers
+from .session import Session, MAX_CONCURRENT
+
+
+log = logging.getLogger('server')
+
+
+class EventLoop:
+
+    def __init__(self, namespace, executor):
+        """Server engine that multiplexes all connections on one asyncio
+        event loop. Only request execution is handed to the executor, so
+        idle connections cost no thread.
+
+        Args:
+            namespace (Namespace): namespace shared by all sessions
+            executor (Executor): executor that runs requests
+        """
+        self._namespace = namespace
+        self._executor = executor
+        self._loop = None
+        self._stopped = None
+
+    def run(self, listeners, running):
+        """Run the event loop until stopped. This method blocks.
+
+        Args:
+            listeners (list): transports and their listeners
+            running (Event): set once listening
+        """
+        asyncio.run(self._serve(listeners, running))
+
+    def stop(self):
+        """Stop the event loop. Safe to call from any thread."""
+        if not self._loop is None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _serve(self, listeners, running):
+        """Listen for connections until stopped.
+
+        Args:
+            listeners (list): transports and their listeners
+            running (Event): set once listening
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        servers = []
+        for trans, listener in listeners:
+            servers.append(await trans.start_server(self._connection,
+                                                    listener))
+        log.info('Started listening for connections on {}'.format(', '.join(
+            format_address(listener.getsockname())
+            for _, listener in listeners)))
+        running.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            for server in servers:
+                server.close()
+            for server in servers:
+                await server.wait_closed()
+        self._loop = None
+
+    async def _connection(self, reader, writer):
+        """Serve one client connection.
+
+        Args:
+            reader (StreamReader): connection reader
+            writer (StreamWriter): connection writer
+        """
+        address = writer.get_extra_info('peername')
+        if not address:
+            # Unix domain socket clients are unnamed
+            address = writer.get_extra_info('sockname')
+        address = format_address(address)
+        log.info('Accepted connection from: {}'.format(address))
+        session = Session(self._namespace)
+        # Unpackers are large, so an idle connection does not hold one
+        unpacker = None
+        # Concurrent requests in progress
+        pending = set()
+        concurrent = asyncio.Semaphore(MAX_CONCURRENT)
+        try:
+            while True:
+                chunk = await reader.read(1048576)
+                if not chunk:
+                    break
+                if unpacker is None:
+                    unpacker, fed, used = session.new_unpacker(), 0, 0
+                unpacker.feed(chunk)
+                fed += len(chunk)
+                # One-way requests are handled in order, in runs
+                oneway = []
+                for request in unpacker:
+                    # Noted before awaiting, while no other connection
+                    # unpacks
+                    request = session.received(request)
+                    for view in receive_buffers(unpacker):
+                        view[:] = await reader.readexactly(len(view))
+                    # Past a partial request, tell() counts its bytes too
+                    used = unpacker.tell()
+                    if request.get('oneway') and not 'id' in request:
+                        oneway.append(request)
+                        continue
+                    if oneway:
+                        await self._loop.run_in_executor(
+                            self._executor, session.handle_all, oneway)
+                        oneway = []
+                    if 'id' in request:
+                        # Respond as soon as done, possibly out of order
+                        await concurrent.acquire()
+                        task = self._loop.create_task(self._respond(
+                            session, request, writer, concurrent))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                    else:
+                        response = await asyncio.wrap_future(
+                            session.submit(request, self._executor))
+                        if not response is None:
+                            _write(writer, response)
+                if oneway:
+                    await self._loop.run_in_executor(
+                        self._executor, session.handle_all, oneway)
+                if used == fed:
+                    unpacker = None
+                await writer.drain()
+            log.info('Client {} disconnected.'.format(address))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            log.info('Client {} disconnected.'.format(address))
+        except Exception:
+            log.exception('Client {} failed.'.format(address))
+        finally:
+            # Finish concurrent requests before releasing their references
+            if pending:
+                await asyncio.wait(pending)
+            writer.close()
+            # Release all remaining references
+            session.close()
+
+    async def _respond(self, session, request, writer, concurrent):
+        """Handle a concurrent request and write its response.
+
+        Args:
+            session (Session): session of the connection
+            request (dict): request
+            writer (StreamWriter): connection writer
+            concurrent (Semaphore): released when done
+        """
+        try:
+            response = await asyncio.wrap_future(
+                session.submit(request, self._executor))
+            if not writer.is_closing():
+                _write(writer, response)
+        finally:
+            concurrent.release()
+
+
+def _write(writer, data):
+    """Write response data.
+
+    Args:
+        writer (StreamWriter): connection writer
+        data (bytes, list): response data, or chunks of it
+    """
+    if isinstance(data, list):
+        # Copied, as arrays may change before the data is sent
+        data = b''.join(data)
+    writer.write(data)
+
+
+def format_address(address):
+    """Format a socket address for logging.
+
+    Args:
+        address (tuple, str): IP address and port, or Unix domain socket path
+
+    Returns:
+        str: 'host:port', or the path
+    """
+    if isinstance(address, tuple):
+        return '{}:{}'.format(*address[:2])
+    return address
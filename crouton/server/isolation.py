@@ -0,0 +1,251 @@
+from collections import deque
+from itertools import count
+from threading import Lock
+import multiprocessing
+import traceback
+import signal
+import stat
+import os
+
+from ..codec import CODECS, new_packer
+
+
+class IsolationError(Exception):
+    pass
+
+
+# Result of __getattr__ for a method of an isolated instance
+BOUND_METHOD = object()
+
+
+class ProcessPool:
+
+    def __init__(self, provider, processes):
+        """Pool of worker processes holding the instances of a type. Each
+        instance lives in one process, which executes all calls to it, so
+        CPU-bound calls do not hold the server's GIL.
+
+        Args:
+            provider (type): type of the instances
+            processes (int): number of worker processes
+        """
+        if processes < 1:
+            raise ValueError('processes: Expected at least 1.')
+        self._provider = provider
+        self._processes = processes
+        self._workers = []
+        self.restart()
+
+    def __call__(self, *args, **kwargs):
+        """Make a new instance in the next worker process.
+
+        Args:
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            IsolatedInstance: the new instance
+        """
+        worker = self._workers[next(self._next) % len(self._workers)]
+        instance = worker.request('open', None, args, kwargs)
+        if isinstance(self._provider, type):
+            instance.cls = self._provider
+        return instance
+
+    def restart(self):
+        """Start new worker processes, e.g. in a forked server process which
+        must not share the workers of its parent.
+        """
+        # Prefer fork, so the type need not be importable by the workers
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            'fork' if 'fork' in methods else None)
+        self._workers = [_Worker(context, self._provider)
+                         for _ in range(self._processes)]
+        self._next = count()
+
+
+class IsolatedInstance:
+
+    def __init__(self, worker, handle, cls=None):
+        """Stand-in for an instance living in a worker process.
+
+        Args:
+            worker (_Worker): worker process holding the instance
+            handle (int): instance id in the worker process
+            cls (type, optional): type of the instance, if known
+        """
+        self._worker = worker
+        self._handle = handle
+        self.cls = cls
+
+    def __del__(self):
+        self._worker.release(self._handle)
+
+    def execute(self, method, args, kwargs):
+        """Call a method of the instance in its worker process.
+
+        Args:
+            method (str): method name
+            args (list): positional arguments
+            kwargs (dict): keyword arguments
+
+        Returns:
+            object: returned value, or an IsolatedInstance if not packable
+        """
+        return self._worker.request('execute', self._handle, method, args,
+                                    kwargs)
+
+
+class _Worker:
+
+    def __init__(self, context, provider):
+        """Worker process and the pipe to it.
+
+        Args:
+            context (BaseContext): multiprocessing context
+            provider (type): type of the instances
+        """
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_serve,
+                                        args=(child_conn, provider),
+                                        daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._lock = Lock()
+        # Handles released by garbage collection, sent with the next request
+        self._released = deque()
+
+    def request(self, *message):
+        """Send a request to the worker process and wait for its reply.
+
+        Args:
+            *message: operation and its arguments
+
+        Returns:
+            object: returned value or IsolatedInstance
+
+        Raises:
+            IsolationError: On error in the worker process.
+        """
+        with self._lock:
+            released = []
+            while self._released:
+                released.append(self._released.popleft())
+            self._conn.send((released, message))
+            ret_type, value = self._conn.recv()
+        if ret_type == 'value':
+            return value
+        elif ret_type == 'reference':
+            return IsolatedInstance(self, value)
+        elif ret_type == 'method':
+            return BOUND_METHOD
+        raise IsolationError(value)
+
+    def release(self, handle):
+        """Release an instance. Never blocks, so it is safe from __del__.
+
+        Args:
+            handle (int): instance id in the worker process
+        """
+        self._released.append(handle)
+
+
+def _serve(conn, provider):
+    """Worker process loop: execute requests until the pipe is closed.
+
+    Args:
+        conn (Connection): pipe to the server
+        provider (type): type of the instances
+    """
+    # The server handles interrupts, the worker exits with the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _detach_sockets(conn.fileno())
+    packer = new_packer(default=CODECS.default)
+    # Instances and their reference counts by [handle]
+    instances = {}
+    while True:
+        try:
+            released, message = conn.recv()
+        except EOFError:
+            break
+        for handle in released:
+            # Unknown handles are ignored, rather than ending the process
+            # with all instances in it
+            entry = instances.get(handle)
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] < 1:
+                del instances[handle]
+        try:
+            reply = _handle(message, instances, provider, packer)
+            conn.send(reply)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+        reply = None
+
+
+def _detach_sockets(keep):
+    """Detach the sockets a forked worker process inherited, such as the
+    server's connections and the pipes of other workers, so that they close
+    when the server closes them. Each is pointed at /dev/null rather than
+    closed, so its descriptor can not be reused.
+
+    Args:
+        keep (int): descriptor to keep
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = range(3, os.sysconf('SC_OPEN_MAX'))
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in fds:
+        if fd in (keep, devnull):
+            continue
+        try:
+            if stat.S_ISSOCK(os.fstat(fd).st_mode):
+                os.dup2(devnull, fd)
+        except OSError:
+            pass
+    os.close(devnull)
+
+
+def _handle(message, instances, provider, packer):
+    """Handle a request in the worker process.
+
+    Args:
+        message (tuple): operation and its arguments
+        instances (dict): instances and their reference counts
+        provider (type): type of the instances
+        packer (msgpack.Packer): packer to test returned containers with
+
+    Returns:
+        tuple: reply
+    """
+    from .session import call_method, is_method
+    action, handle = message[:2]
+    if action == 'open':
+        ret = provider(*message[2], **message[3])
+    else:
+        obj = instances[handle][0]
+        ret = call_method(obj, *message[2:])
+        if message[2] == '__getattr__' and is_method(obj, ret):
+            return ('method', None)
+        # Told by type, only containers are packed to tell by their items
+        packable = CODECS.packable(type(ret))
+        if packable is None:
+            try:
+                packer.pack(ret)
+                packable = True
+            except TypeError:
+                pass
+        if packable:
+            return ('value', ret)
+    # Not packable, keep it here and reply with a reference
+    handle = id(ret)
+    if handle in instances:
+        instances[handle][1] += 1
+    else:
+        instances[handle] = [ret, 1]
+    return ('reference', handle)
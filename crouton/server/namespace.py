@@ -1,10 +1,30 @@
+from contextlib import nullcontext
 from threading import Lock
 
+from .schema import Schemas
+
+
+# Concurrency policies for registered types and instances
+EXCLUSIVE = 'exclusive'
+SHARED = 'shared'
+THREAD_SAFE = 'thread-safe'
+CONCURRENCY = (EXCLUSIVE, SHARED, THREAD_SAFE)
+
+# Lock used by 'thread-safe' instances, does not lock at all
+NO_LOCK = nullcontext()
+
 
 class Namespace:
 
     def __init__(self):
         self.types = {}
+        # Lock factories by [type name]
+        self.type_locks = {}
+        self.schemas = Schemas()
+        # (type, method) of calls that returned unpackable containers
+        self.unpackable = set()
+        # Per-instance locks by [instance id]
+        self._locks = {}
         # Instances by [instance id]
         self._instances = {}
         # Instances by [name]
@@ -46,13 +66,29 @@ class Namespace:
         """On exit, unlock namespace."""
         self._lock.release()
 
-    def add(self, instance, inst_id, owner, name=None):
+    def lock(self, key):
+        """Get the lock guarding an instance.
+
+        Args:
+            key (int, str): instance id or name
+
+        Returns:
+            object: context manager that serializes use of the instance
+        """
+        if not isinstance(key, int):
+            key = id(self._instances_by_name[key])
+        return self._locks[key]
+
+    def add(self, instance, inst_id, owner, name=None, lock=None):
         """Add an instance and acquire reference.
 
         Args:
             instance (object): instance
             inst_id (int): instance id
             owner (object): owner
+            name (str, optional): name with which to register
+            lock (object, optional): lock guarding the instance, by default
+                a new exclusive lock
         """
         owner = id(owner)
         if inst_id in self._instances:
@@ -64,6 +100,7 @@ class Namespace:
         else:
             self._instances[inst_id] = instance
             self._ref_counts[inst_id] = {owner: 1}
+            self._locks[inst_id] = Lock() if lock is None else lock
         if not name is None:
             self._instances_by_name[name] = instance
 
@@ -99,6 +136,7 @@ class Namespace:
             if not ref_counts:
                 del self._ref_counts[inst_id]
                 del self._instances[inst_id]
+                del self._locks[inst_id]
             return True
         return False
 
@@ -116,3 +154,26 @@ class Namespace:
             if not ref_counts:
                 del self._ref_counts[inst_id]
                 del self._instances[inst_id]
+                del self._locks[inst_id]
+
+
+def lock_factory(concurrency):
+    """Make a factory of locks for a concurrency policy.
+
+    Args:
+        concurrency (str): 'exclusive' for a lock per instance, 'shared' for
+            a single lock shared by all instances or 'thread-safe' for no
+            locking
+
+    Returns:
+        callable: returns the lock for a new instance
+    """
+    if concurrency == EXCLUSIVE:
+        return Lock
+    elif concurrency == SHARED:
+        shared_lock = Lock()
+        return lambda: shared_lock
+    elif concurrency == THREAD_SAFE:
+        return lambda: NO_LOCK
+    raise ValueError('concurrency: Expected one of {}.'.format(
+        ', '.join('\'{}\''.format(policy) for policy in CONCURRENCY)))
@@ -0,0 +1,135 @@
+from concurrent.futures import Executor, Future
+from collections import deque
+from threading import Condition, Lock, Thread, current_thread
+import os
+
+
+class ThreadPool(Executor):
+
+    def __init__(self, min_workers=0, max_workers=None, idle_timeout=60.0):
+        """Bounded pool of threads draining a queue of requests.
+
+        The pool grows when more work is queued than there are idle threads
+        and shrinks back to min_workers once threads have been idle for
+        idle_timeout seconds.
+
+        Args:
+            min_workers (int, optional): number of threads kept alive,
+                default 0
+            max_workers (int, optional): maximum number of threads, default
+                as ThreadPoolExecutor
+            idle_timeout (float, optional): seconds before an idle thread
+                exits, default 60
+        """
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_workers < 1:
+            raise ValueError('max_workers: Expected at least 1.')
+        if not 0 <= min_workers <= max_workers:
+            raise ValueError('min_workers: Expected 0 <= min_workers <= '
+                             'max_workers.')
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._idle_timeout = idle_timeout
+        self._queue = deque()
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._threads = set()
+        self._idle = 0
+        self._shutdown = False
+        with self._lock:
+            for _ in range(min_workers):
+                self._start_thread()
+
+    @property
+    def size(self):
+        """Number of threads in the pool.
+
+        Returns:
+            int: number of threads
+        """
+        return len(self._threads)
+
+    @property
+    def queued(self):
+        """Number of requests waiting for a thread.
+
+        Returns:
+            int: queue depth
+        """
+        return len(self._queue)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a callable for execution.
+
+        Args:
+            fn (callable): callable to execute
+            *args: tuple of positional arguments
+            **kwargs: dict of keyword arguments
+
+        Returns:
+            Future: result of the callable
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit to a shut down pool.')
+            self._queue.append((future, fn, args, kwargs))
+            # Grow when queued work exceeds the idle threads
+            if len(self._queue) > self._idle and \
+                    len(self._threads) < self._max_workers:
+                self._start_thread()
+            self._not_empty.notify()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Stop the pool once the queue is drained.
+
+        Args:
+            wait (bool, optional): wait for all threads to exit, default True
+            cancel_futures (bool, optional): cancel queued requests, default
+                False
+        """
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft()[0].cancel()
+            self._not_empty.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start_thread(self):
+        """Start a thread. Lock must be held."""
+        thread = Thread(target=self._work, daemon=True)
+        self._threads.add(thread)
+        thread.start()
+
+    def _work(self):
+        """Thread loop: execute queued requests until idle or shut down."""
+        while True:
+            with self._lock:
+                self._idle += 1
+                while not self._queue and not self._shutdown:
+                    if not self._not_empty.wait(self._idle_timeout) and \
+                            not self._queue and \
+                            len(self._threads) > self._min_workers:
+                        break
+                self._idle -= 1
+                if not self._queue:
+                    # Idle timeout or shut down
+                    self._threads.discard(current_thread())
+                    return
+                future, fn, args, kwargs = self._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as ex:
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+            # Drop references before waiting for more work
+            del future, fn, args, kwargs
@@ -0,0 +1,66 @@
+from itertools import count
+from threading import Lock
+import inspect
+
+
+class Schemas:
+
+    def __init__(self):
+        """Cache of type schemas. A schema describes the attributes of a type,
+        so clients can make a proxy class for it and resolve method lookups
+        locally. Each schema has an id, so it needs sending only once.
+        """
+        self._lock = Lock()
+        self._ids = count()
+        # Schema id and schema by [type]
+        self._schemas = {}
+
+    def get(self, cls):
+        """Get the schema of a type, made once.
+
+        Args:
+            cls (type): type
+
+        Returns:
+            tuple: schema id (int) and schema (dict)
+        """
+        with self._lock:
+            if not cls in self._schemas:
+                self._schemas[cls] = (next(self._ids), make_schema(cls))
+            return self._schemas[cls]
+
+
+def make_schema(cls):
+    """Describe the attributes of a type.
+
+    Args:
+        cls (type): type
+
+    Returns:
+        dict: schema with the type's 'name' and lists of the names of its
+            'methods', 'properties', plain class 'attributes' and of the
+            'dunders' it supports
+    """
+    schema = {
+        'name': cls.__qualname__,
+        'methods': [],
+        'properties': [],
+        'attributes': [],
+        'dunders': [],
+    }
+    for name in dir(cls):
+        try:
+            attr = inspect.getattr_static(cls, name)
+        except AttributeError:
+            continue
+        if name.startswith('__') and name.endswith('__'):
+            # A special method set to None is unsupported, e.g. __hash__
+            if not getattr(cls, name, None) is None:
+                schema['dunders'].append(name)
+        elif inspect.isroutine(attr):
+            schema['methods'].append(name)
+        elif inspect.isdatadescriptor(attr):
+            schema['properties'].append(name)
+        else:
+            schema['attributes'].append(name)
+    return schema
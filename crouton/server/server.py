@@ -1,16 +1,21 @@
-from threading import Event, Thread
-import traceback
+from concurrent.futures import wait
+from threading import BoundedSemaphore, Event, Lock, Thread
+from weakref import WeakSet
 import logging
+import selectors
+import signal
 import socket
-import msgpack
-try:
-    import msgpack_numpy
-    msgpack_numpy.patch()
-except ImportError:
-    # msgpack_numpy is optional
-    pass
-
-from .namespace import Namespace
+import traceback
+import gc
+import os
+from ..codec import receive_buffers, recv_into
+from ..shm import SharedMemoryChannel, is_local
+from ..transport import Transport, TcpTransport, UnixTransport, transport
+from .namespace import Namespace, EXCLUSIVE, THREAD_SAFE, lock_factory
+from .session import Session, MAX_CONCURRENT, packer
+from .eventloop import EventLoop, format_address
+from .pool import ThreadPool
+from .isolation import ProcessPool
 
 
 # Setup logging
@@ -28,64 +33,255 @@ class Server:
     def __init__(self):
         self._running = Event()
         self._namespace = Namespace()
+        self._event_loop = None
+        self._children = []
+        self._process_pools = []
 
-    def run(self, host='0.0.0.0', port=5000):
+    def run(self, host='0.0.0.0', port=5000, engine='thread', min_workers=0,
+            max_workers=None, idle_timeout=60.0, processes=None, path=None,
+            url=None):
         """Start the server. This blocking method runs the server
         request-reply loop.
 
+        Requests are executed by a bounded pool of threads, separate from the
+        threads or event loop doing connection I/O.
+
         Args:
             host (str, optional): host address to bind to, default '0.0.0.0'
-            port (int, optional): host port to bind to, default 5000
+            port (int, optional): host port to bind to, default 5000, None to
+                listen on paths and URLs only
+            engine (str, optional): 'thread' (default) to serve each
+                connection with its own thread, 'asyncio' to multiplex all
+                connections on one event loop
+            min_workers (int, optional): number of threads executing requests
+                kept alive, default 0
+            max_workers (int, optional): maximum number of threads executing
+                requests, default as ThreadPoolExecutor
+            idle_timeout (float, optional): seconds before an idle thread
+                executing requests exits, default 60
+            processes (int, optional): number of server processes to fork,
+                default None to serve from this process. Each process
+                accepts on its own SO_REUSEPORT socket and inherits
+                everything registered so far copy-on-write. A connection
+                stays with one process, and so does its namespace.
+            path (str, list, optional): path, or list of paths, of Unix
+                domain sockets to listen on besides the port, default None.
+                They are bound before forking processes, which share them.
+            url (str, Transport, list, optional): URL, or list of URLs, of
+                transports to listen on besides the port and paths, e.g.
+                'tcp://0.0.0.0:5001?keepalive=1', default None
+        """
+        if not engine in ('thread', 'asyncio'):
+            raise ValueError('engine: Expected \'thread\' or \'asyncio\'.')
+        transports = []
+        if not port is None:
+            transports.append(TcpTransport(host, port))
+        for path in [path] if isinstance(path, str) else path or []:
+            transports.append(UnixTransport(path))
+        for url in [url] if isinstance(url, (str, Transport)) else url or []:
+            transports.append(transport(url))
+        if not transports:
+            raise ValueError('port: Expected a port, or a path or URL to '
+                             'listen on.')
+        pool_args = (min_workers, max_workers, idle_timeout)
+        listeners = []
+        try:
+            if processes is None:
+                for trans in transports:
+                    listeners.append((trans, trans.listen()))
+                self._serve(engine, pool_args, listeners)
+            else:
+                for trans in transports:
+                    if trans.shared:
+                        listeners.append((trans, trans.listen()))
+                self._run_processes(engine, pool_args, transports, listeners,
+                                    processes)
+        finally:
+            for trans, listener in listeners:
+                trans.close(listener)
+
+    def _serve(self, engine, pool_args, listeners):
+        """Serve connections from this process.
+
+        Args:
+            engine (str): 'thread' or 'asyncio'
+            pool_args (tuple): ThreadPool arguments
+            listeners (list): transports and their listeners
+        """
+        pool = ThreadPool(*pool_args)
+        try:
+            if engine == 'thread':
+                self._run_threads(pool, listeners)
+            else:
+                self._run_event_loop(pool, listeners)
+        finally:
+            pool.shutdown(wait=False)
+
+    def _run_processes(self, engine, pool_args, transports, listeners,
+                       processes):
+        """Fork server processes and wait for them to exit.
+
+        Args:
+            engine (str): 'thread' or 'asyncio'
+            pool_args (tuple): ThreadPool arguments
+            transports (list): transports to listen on
+            listeners (list): transports and their listeners shared by the
+                processes, the other transports listen in each process
+            processes (int): number of processes
+        """
+        if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+            raise NotImplementedError('processes: Requires fork() and '
+                                      'SO_REUSEPORT.')
+        if processes < 1:
+            raise ValueError('processes: Expected at least 1.')
+        # Keep the collector from touching, and so copying, inherited objects
+        gc.freeze()
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                self._children = []
+                for pool in self._process_pools:
+                    pool.restart()
+                status = 0
+                try:
+                    own = [(trans, trans.listen(reuse_port=True))
+                           for trans in transports if not trans.shared]
+                    self._serve(engine, pool_args, listeners + own)
+                except BaseException:
+                    log.exception('Server process {} failed.'.format(os.getpid()))
+                    status = 1
+                finally:
+                    os._exit(status)
+            self._children.append(pid)
+        log.info('Started server processes: {}'.format(
+            ', '.join(str(pid) for pid in self._children)))
+        self._running.set()
+        try:
+            while self._children:
+                pid, status = os.wait()
+                if pid in self._children:
+                    self._children.remove(pid)
+                    log.info('Server process {} exited with status {}.'
+                             .format(pid, status))
+        finally:
+            self._kill_children()
+            while self._children:
+                os.waitpid(self._children.pop(), 0)
+            gc.unfreeze()
+            log.info('Server shutdown.')
+
+    def _run_threads(self, pool, listeners):
+        """Accept connections and start a Worker thread for each.
+
+        Args:
+            pool (ThreadPool): pool executing requests
+            listeners (list): transports and their listeners
         """
-        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        listen_socket.bind((host, port))
-        listen_socket.listen(5)
-        log.info('Started listening for connections on {}:{}'.format(host, port))
+        selector = selectors.DefaultSelector()
+        for trans, listener in listeners:
+            # Shared with forked processes, which may accept first
+            listener.setblocking(False)
+            selector.register(listener, selectors.EVENT_READ, trans)
+        log.info('Started listening for connections on {}'.format(', '.join(
+            format_address(listener.getsockname())
+            for _, listener in listeners)))
         self._running.set()
+        workers = WeakSet()
         try:
             while self._running.is_set():
-                client_socket, address = listen_socket.accept()
-                log.info('Accepted connection from: {}:{}'.format(*address))
-                worker = Worker(client_socket, address, self._namespace)
-                worker.start()
+                for key, _ in selector.select():
+                    try:
+                        client_socket, address = key.data.accept(key.fileobj)
+                    except BlockingIOError:
+                        continue
+                    log.info('Accepted connection from: {}'.format(
+                        format_address(address)))
+                    worker = Worker(client_socket, address, self._namespace,
+                                    pool)
+                    workers.add(worker)
+                    worker.start()
         finally:
-            listen_socket.close()
+            selector.close()
+            # Close remaining connections, once their requests are finished
+            workers = list(workers)
+            for worker in workers:
+                worker.stop()
+            for worker in workers:
+                worker.join()
             log.info('Closed listening socket. Server shutdown.')
 
-    def register(self, instance, name):
+    def _run_event_loop(self, pool, listeners):
+        """Serve all connections from one event loop.
+
+        Args:
+            pool (ThreadPool): pool executing requests
+            listeners (list): transports and their listeners
+        """
+        self._event_loop = EventLoop(self._namespace, pool)
+        try:
+            self._event_loop.run(listeners, self._running)
+        finally:
+            self._event_loop = None
+        log.info('Closed listening socket. Server shutdown.')
+
+    def register(self, instance, name, concurrency=EXCLUSIVE):
         """Register a named instance.
 
         Args:
             instance (object): instance to register
             name (str): name with which to register
+            concurrency (str, optional): 'exclusive' (default) or 'shared' to
+                serialize calls to the instance, 'thread-safe' for no locking
         """
         if not isinstance(name, str):
             raise ValueError('name: Expected a string.')
+        make_lock = lock_factory(concurrency)
         with self._namespace:
             if name in self._namespace:
                 raise KeyError('An instance by name \'{}\' already exists.'
                     .format(name))
             inst_id = id(instance)
-            self._namespace.add(instance, inst_id, self, name)
+            self._namespace.add(instance, inst_id, self, name,
+                                lock=make_lock())
         log.info('Registered instance {} by name \'{}\'.'.format(inst_id, name))
 
-    def register_type(self, provider, name=None):
+    def register_type(self, provider, name=None, concurrency=EXCLUSIVE,
+                      processes=None):
         """Register a type.
 
+        Calls to instances are serialized according to the concurrency
+        policy of their type. Objects returned by reference from an instance
+        share the lock of that instance.
+
         Args:
             provider (type): type to register
             name (str, optional): name with which to register
+            concurrency (str, optional): 'exclusive' (default) for a lock per
+                instance, 'shared' for one lock shared by all instances of
+                the type, 'thread-safe' for no locking
+            processes (int, optional): number of worker processes to isolate
+                instances in, default None to keep instances in the server.
+                Each instance lives in one worker process, which serializes
+                calls to it, so CPU-bound types do not hold the server's GIL.
         """
         if name is None:
             # If no name is given, register using name of type.
             name = provider.__name__
         elif not isinstance(name, str):
             raise ValueError('name: Expected a string.')
+        make_lock = lock_factory(THREAD_SAFE if processes else concurrency)
         with self._namespace:
             if name in self._namespace.types:
                 raise KeyError('A type by name \'{}\' already exists.'.format(name))
-            self._namespace.types[name] = provider
+            if not processes is None:
+                pool = ProcessPool(provider, processes)
+                self._process_pools.append(pool)
+            self._namespace.types[name] = provider if processes is None \
+                else pool
+            self._namespace.type_locks[name] = make_lock
+        if isinstance(provider, type):
+            # Made now, so opening the first instance does not
+            self._namespace.schemas.get(provider)
         log.info('Registered type {} by name \'{}\'.'.format(provider, name))
 
     def _wait_for(self):
@@ -95,200 +291,172 @@ class Server:
     def _shutdown(self):
         """Shutdown server. THIS IS FOR UNIT TESTING."""
         self._running.clear()
+        if not self._event_loop is None:
+            self._event_loop.stop()
+        self._kill_children()
+
+    def _kill_children(self):
+        """Terminate forked server processes."""
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
 
 
 class Worker(Thread):
 
-    def __init__(self, sock, address, namespace):
+    def __init__(self, sock, address, namespace, pool):
         super().__init__()
         self._socket = sock
         self._address = address
-        self._namespace = namespace
+        self._session = Session(namespace)
+        self._pool = pool
+        self._send_lock = Lock()
+        # Request received ahead, while collecting one-way requests
+        self._next = None
+        # Concurrent requests in progress
+        self._pending = set()
+        self._concurrent = BoundedSemaphore(MAX_CONCURRENT)
         self._init_serdes()
-        self._inst_ids = set()
 
     def run(self):
         try:
             while self._dispatch():
                 continue
-            log.info('Client {}:{} disconnected.'.format(*self._address))
+            log.info('Client {} disconnected.'.format(
+                format_address(self._address)))
         finally:
+            # Finish concurrent requests before releasing their references
+            wait(list(self._pending))
             # Close client socket
             self._socket.close()
             # Release all remaining references
-            with self._namespace:
-                self._namespace.release_all(self._inst_ids, self)
+            self._session.close()
+
+    def stop(self):
+        """Stop receiving requests, closing the connection once the requests
+        in progress are finished.
+        """
+        try:
+            self._socket.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
 
     def _dispatch(self):
         """ Receive a request, delegate and send response.
 
+        Requests with an 'id' execute concurrently and their responses are
+        sent as each finishes. Requests without are executed in order,
+        'oneway' requests without a response, in runs of those already
+        received.
+
         Returns:
             bool: False if orderly shutdown occurred
         """
         request = self._receive()
         if request is None:
             return False
+        if request.get('action') == 'transport':
+            self._transport(request)
+        elif 'id' in request:
+            self._concurrent.acquire()
+            future = self._session.submit(request, self._pool, self._send)
+            self._pending.add(future)
+            future.add_done_callback(self._done)
+        elif request.get('oneway'):
+            oneway = [request]
+            while True:
+                request = self._receive(blocking=False)
+                if request is None or not request.get('oneway') or \
+                        'id' in request:
+                    break
+                oneway.append(request)
+            self._next = request
+            self._pool.submit(self._session.handle_all, oneway).result()
+        else:
+            self._send(self._session.submit(request, self._pool).result())
+        return True
+
+    def _transport(self, request):
+        """Move the connection to shared memory made by the client, which
+        must be on the same host, see SharedMemoryChannel.attach().
+        Acknowledged before the move.
+
+        Args:
+            request (dict): transport request
+        """
         try:
-            action = request['action']
-            if action == 'execute':
-                response = self._action_execute(request)
-            elif action == 'open':
-                response = self._action_open(request)
-            elif action == 'close':
-                response = self._action_close(request)
-            else:
-                raise ValueError('Invalid request action: \'{}\''.format(action))
+            if not is_local(self._socket):
+                raise ValueError('Client is not on this host.')
+            channel = SharedMemoryChannel.attach(
+                self._socket, request['shared_memory'], request['size'],
+                request.get('nonce'))
         except Exception:
-            response = self._packer.pack({
+            self._send(packer().pack({
                 'type': 'error',
                 'value': traceback.format_exc(),
-            })
-        self._socket.sendall(response)
-        return True
-
-    def _init_serdes(self):
-        self._packer = msgpack.Packer(use_bin_type=True)
-        """
-        For backwards compatibility, try these kwargs in order, until one succeeds.
-        * 'encoding' and 'unicode_errors' options are deprecated. There is new 'raw' option.
-          It is True by default for backward compatibility, but it is changed to False in
-          near future. You can use raw=False instead of encoding='utf-8'.
-        * For backwards compatibility, set 'max_buffer_size' explicitly.
-        * For backwards compatibility, set 'strict_map_key' to False explicitly, when possible.
-        """
-        kwargs_list = (
-            {'strict_map_key': False, 'raw': False},
-            {'raw': False},
-            {'encoding': 'utf-8'},
-        )
-        for kwargs in kwargs_list:
-            try:
-                self._unpacker = msgpack.Unpacker(
-                    use_list=True, max_buffer_size=2**31-1, **kwargs)
-            except TypeError as ex:
-                continue
-            break
-        else:
-            raise RuntimeError('Failed to create unpacker.')
+            }))
+            return
+        self._send(packer().pack({'type': 'value', 'value': None}))
+        self._socket = channel
+        log.info('Client {} moved to shared memory.'.format(
+            format_address(self._address)))
 
-    def _action_open(self, request):
-        """Open action handler.
+    def _done(self, future):
+        """Concurrent request done callback.
 
         Args:
-            request (dict): request
-
-        Returns:
-            bytes: response data
+            future (Future): request future
         """
-        if 'provider' in request:
-            # Make and return a new instance
-            provider = request['provider']
-            with self._namespace:
-                types = self._namespace.types
-                if not provider in types:
-                    raise TypeError('Unknown type \'{}\'.'.format(provider))
-                obj = types[provider](*request['args'], **request['kwargs'])
-                instance = id(obj)
-                response = self._packer.pack({
-                    'type': 'reference',
-                    'value': instance,
-                })
-                self._namespace.add(obj, instance, self)
-            self._inst_ids.add(instance)
-        elif 'instance' in request:
-            # Return a named instance
-            instance = request['instance']
-            with self._namespace:
-                if not instance in self._namespace:
-                    raise ValueError('Unknown instance: {}'.format(instance))
-                response = self._packer.pack({
-                    'type': 'reference',
-                    'value': instance,
-                })
-                self._namespace.acquire(instance, self)
-            self._inst_ids.add(instance)
-        else:
-            raise ValueError('Bad open() request. Expected \'instance\' '
-                             'or \'provider\'.')
-        return response
+        self._pending.discard(future)
+        self._concurrent.release()
 
-    def _action_close(self, request):
-        """Close action handler.
+    def _send(self, data):
+        """Send response data.
 
         Args:
-            request (dict): request
-
-        Returns:
-            bytes: response data
+            data (bytes, list): response data, or chunks of it
         """
-        instance = request['instance']
-        with self._namespace:
-            if not instance in self._namespace:
-                raise KeyError('Instance {} does not exist.'.format(instance))
-            released = self._namespace.release(instance, self)
-        if released:
-            self._inst_ids.remove(instance)
-        response = self._packer.pack({
-            'type': 'value',
-            'value': None,
-        })
-        return response
-
-    def _action_execute(self, request):
-        """Execute action handler.
+        with self._send_lock:
+            if isinstance(data, list):
+                # Array data is sent from the arrays, see pack_buffers()
+                for chunk in data:
+                    self._socket.sendall(chunk)
+            else:
+                self._socket.sendall(data)
 
-        Args:
-            request (dict): request
+    def _init_serdes(self):
+        self._unpacker = self._session.new_unpacker()
 
-        Returns:
-            bytes: response data
-        """
-        instance = request['instance']
-        with self._namespace:
-            if instance not in self._namespace:
-                raise KeyError('Instance \'{}\' does not exist.'.format(instance))
-            method = request['method']
-            if method in METHOD_HANDLERS:
-                ret = METHOD_HANDLERS[method](self._namespace[instance],
-                    *request['args'], **request['kwargs'])
-            else:
-                ret = getattr(self._namespace[instance], method)(
-                    *request['args'], **request['kwargs'])
-            try:
-                response = self._packer.pack({
-                    'type': 'value',
-                    'value': ret,
-                })
-            except TypeError:
-                instance = id(ret)
-                response = self._packer.pack({
-                    'type': 'reference',
-                    'value': instance,
-                })
-                self._namespace.add(ret, instance, self)
-                self._inst_ids.add(instance)
-        return response
-
-    def _receive(self):
+    def _receive(self, blocking=True):
         """Receive and unpack request.
 
+        Args:
+            blocking (bool, optional): wait for a request, default True.
+                Otherwise, only a request already received is returned.
+
         Returns:
             object: request or None
         """
+        if not self._next is None:
+            request, self._next = self._next, None
+            return request
         while True:
-            chunk = self._socket.recv(1048576)
-            if not chunk:
-                return None
-            self._unpacker.feed(chunk)
+            # Requests may already be buffered, e.g. when pipelined
             try:
                 for request in self._unpacker:
-                    return request
+                    for view in receive_buffers(self._unpacker):
+                        if not recv_into(self._socket, view):
+                            return None
+                    return self._session.received(request)
             except Exception:
                 self._init_serdes()
                 raise
+            if not blocking:
+                return None
+            chunk = self._socket.recv(1048576)
+            if not chunk:
+                return None
+            self._unpacker.feed(chunk)
 
-
-METHOD_HANDLERS = {
-    '__getattr__': getattr,
-    '__bool__': bool,
-}
@@ -0,0 +1,635 @@
+from concurrent.futures import Future
+from itertools import islice
+from threading import Lock, local
+import traceback
+import logging
+
+from ..codec import CODECS, EXT_REFERENCE, decode_error, encode_reference, \
+    ext_hook, new_packer, new_unpacker, pack_buffers, resolve
+from .isolation import IsolatedInstance, BOUND_METHOD
+
+
+log = logging.getLogger('server')
+
+# Maximum number of concurrent requests per connection
+MAX_CONCURRENT = 64
+
+class Session:
+
+    def __init__(self, namespace):
+        """Protocol state of one client connection. A session handles
+        decoded requests, independent of how its connection is served.
+
+        Requests carrying an 'id' may be handled concurrently, their
+        responses carry the same 'id'. References carry the 'schema' id of
+        their type, the schema itself is sent once per session. Any request
+        may carry a 'release' list of instance ids to release first. A
+        'oneway' request has no response, its errors are logged. Arguments
+        may be references to instances, see new_unpacker().
+
+        The result of a request with 'hold' set is kept as a promise, by its
+        'id'. Later requests may then name their instance by 'promise' rather
+        than 'instance', before the result is known: they are scheduled once
+        it is.
+
+        Args:
+            namespace (Namespace): namespace shared by all sessions
+        """
+        self._namespace = namespace
+        self._inst_ids = set()
+        # Ids of the schemas sent to the client
+        self._schema_ids = set()
+        self._lock = Lock()
+        # Futures of the instance ids of held results by [request id]
+        self._promises = {}
+        # Request ids of held results by [instance id]
+        self._promise_ids = {}
+        # Number of references decoded since the last request
+        self._references = 0
+
+    def new_unpacker(self):
+        """Make an unpacker of requests for this session. References decode
+        to markers, which are resolved to their instances when the request
+        is handled. Requests must be passed to received() as decoded.
+
+        Returns:
+            msgpack.Unpacker: unpacker
+        """
+        return new_unpacker(ext_hook=self._ext_hook)
+
+    def received(self, request):
+        """Note a decoded request.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            dict: request
+        """
+        if self._references:
+            # Resolved when handled, only requests holding references
+            self._references = 0
+            request['references'] = True
+        error = decode_error()
+        if not error is None:
+            # Failed when handled, in its place
+            request['undecodable'] = error
+        return request
+
+    def _ext_hook(self, code, data):
+        """Decode an ext type.
+
+        Args:
+            code (int): ext type code
+            data (bytes): ext type data
+
+        Returns:
+            object: decoded object
+        """
+        if code == EXT_REFERENCE:
+            self._references += 1
+        return ext_hook(code, data)
+
+    def _lookup(self, reference):
+        """Get the instance of a reference.
+
+        Args:
+            reference (Reference): reference
+
+        Returns:
+            object: instance
+
+        Raises:
+            KeyError: If not referenced by this session.
+        """
+        with self._namespace:
+            if not reference.instance in self._inst_ids:
+                raise KeyError('Instance \'{}\' does not exist.'.format(
+                    reference.instance))
+            return self._namespace[reference.instance]
+
+    def submit(self, request, executor, respond=None):
+        """Schedule a request on an executor. A request on a pending promise
+        is scheduled once the promise is resolved.
+
+        Args:
+            request (dict): request
+            executor (Executor): executor that runs requests
+            respond (callable, optional): called with the response data
+
+        Returns:
+            Future: response data, or result of respond
+        """
+        if request.get('hold'):
+            with self._lock:
+                self._promises[request['id']] = Future()
+        parent = None
+        if 'promise' in request:
+            with self._lock:
+                parent = self._promises.get(request['promise'])
+        if parent is None or parent.done():
+            return executor.submit(self._run, request, respond)
+        future = Future()
+
+        def schedule(_):
+            try:
+                inner = executor.submit(self._run, request, respond)
+            except Exception as ex:
+                future.set_exception(ex)
+            else:
+                inner.add_done_callback(lambda inner: _copy(inner, future))
+        parent.add_done_callback(schedule)
+        return future
+
+    def _run(self, request, respond):
+        """Handle a scheduled request.
+
+        Args:
+            request (dict): request
+            respond (callable): called with the response data, or None
+
+        Returns:
+            object: response data, or result of respond
+        """
+        response = self.handle(request)
+        if request.get('hold'):
+            # Not resolved to a reference, so dependent requests fail
+            with self._lock:
+                promise = self._promises.get(request['id'])
+                if not promise is None and not promise.done():
+                    del self._promises[request['id']]
+                else:
+                    promise = None
+            if not promise is None:
+                promise.set_result(None)
+        return response if respond is None else respond(response)
+
+    def handle(self, request):
+        """Delegate a request to its action handler.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes, list: response data, or chunks of it, see pack_buffers().
+                None for a 'oneway' request
+        """
+        try:
+            if 'release' in request:
+                self._release(request['release'])
+            if 'undecodable' in request:
+                raise ValueError('Could not decode request.\n{}'.format(
+                    request['undecodable']))
+            if 'promise' in request:
+                request['instance'] = self._resolve(request['promise'])
+            if request.get('references'):
+                request = resolve(request, self._lookup)
+            action = request['action']
+            if action == 'execute':
+                response = self._action_execute(request)
+            elif action == 'open':
+                response = self._action_open(request)
+            elif action == 'close':
+                response = self._action_close(request)
+            elif action == 'iterate':
+                response = self._action_iterate(request)
+            elif action == 'batch':
+                response = self._action_batch(request)
+            else:
+                raise ValueError('Invalid request action: \'{}\''.format(
+                    action))
+        except Exception:
+            if request.get('oneway'):
+                log.error('One-way request failed.\n{}'.format(
+                    traceback.format_exc()))
+                return None
+            return self._pack(request, 'error', traceback.format_exc())
+        return None if request.get('oneway') else response
+
+    def handle_all(self, requests):
+        """Handle requests in order, discarding their responses, e.g. a run
+        of one-way requests.
+
+        Args:
+            requests (list): requests
+        """
+        for request in requests:
+            self.handle(request)
+
+    def close(self):
+        """Release all remaining references."""
+        with self._namespace:
+            self._namespace.release_all(self._inst_ids, self)
+        with self._lock:
+            self._promises.clear()
+            self._promise_ids.clear()
+
+    def _resolve(self, request_id):
+        """Resolve a promise.
+
+        Args:
+            request_id (int): id of the request holding its result
+
+        Returns:
+            int: instance id
+
+        Raises:
+            ValueError: If the result is not a reference or not held.
+        """
+        with self._lock:
+            promise = self._promises.get(request_id)
+        if promise is None or not promise.done() or promise.result() is None:
+            raise ValueError('Promise {} did not resolve to a '
+                             'reference.'.format(request_id))
+        return promise.result()
+
+    def _hold(self, request_id, instance):
+        """Resolve a promise to an instance. Dependent requests are scheduled.
+
+        Args:
+            request_id (int): id of the request holding the result
+            instance (int): instance id
+        """
+        with self._lock:
+            promise = self._promises.get(request_id)
+            if promise is None:
+                return
+            self._promise_ids.setdefault(instance, []).append(request_id)
+        promise.set_result(instance)
+
+    def _pack(self, request, ret_type, value, **fields):
+        """Pack a response to a request.
+
+        Args:
+            request (dict): request
+            ret_type (str): 'value', 'reference' or 'error'
+            value (object): returned value
+            **fields: additional response fields
+
+        Returns:
+            bytes, list: response data, or chunks of it, see pack_buffers()
+
+        Raises:
+            TypeError: If value is not packable.
+        """
+        response = {
+            'type': ret_type,
+            'value': value,
+        }
+        response.update(fields)
+        if 'id' in request:
+            response['id'] = request['id']
+        return pack_buffers(packer(), response)
+
+    def _pack_mixed(self, request, ret_type, value, lock, **fields):
+        """Pack a response to a request, with the objects in value that can
+        not be packed as references. The response is marked to have
+        'references'.
+
+        Args:
+            request (dict): request
+            ret_type (str): 'value' or 'items'
+            value (object): returned value
+            lock (object): lock guarding the referenced objects
+            **fields: additional response fields
+
+        Returns:
+            bytes, list: response data, or chunks of it, see pack_buffers()
+        """
+        instances = []
+
+        def default(obj):
+            try:
+                return CODECS.default(obj)
+            except TypeError:
+                pass
+            instance = id(obj)
+            with self._namespace:
+                self._namespace.add(obj, instance, self, lock=lock)
+                self._inst_ids.add(instance)
+            instances.append(instance)
+            return encode_reference(instance, **self._schema_fields(obj))
+
+        response = {
+            'type': ret_type,
+            'value': value,
+            'references': True,
+        }
+        response.update(fields)
+        if 'id' in request:
+            response['id'] = request['id']
+        try:
+            return pack_buffers(new_packer(default=default), response)
+        except Exception:
+            self._release(instances)
+            raise
+
+    def _pack_reference(self, request, obj, instance):
+        """Pack a reference response with the schema of the object's type.
+
+        Args:
+            request (dict): request
+            obj (object): referenced object
+            instance (int): instance id
+
+        Returns:
+            bytes: response data
+        """
+        response = self._pack(request, 'reference', instance,
+                              **self._schema_fields(obj))
+        if request.get('hold'):
+            self._hold(request['id'], instance)
+        return response
+
+    def _schema_fields(self, obj):
+        """Get the schema fields of a reference to an object.
+
+        Args:
+            obj (object): referenced object
+
+        Returns:
+            dict: 'schema' id, and 'schema_def' if not sent before
+        """
+        cls = type_of(obj)
+        if cls is None:
+            # Type of a derived isolated instance is unknown
+            return {}
+        schema_id, schema = self._namespace.schemas.get(cls)
+        fields = {'schema': schema_id}
+        if not schema_id in self._schema_ids:
+            self._schema_ids.add(schema_id)
+            fields['schema_def'] = schema
+        return fields
+
+    def _action_open(self, request):
+        """Open action handler.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes: response data
+        """
+        if 'provider' in request:
+            # Make and return a new instance
+            provider = request['provider']
+            with self._namespace:
+                types = self._namespace.types
+                if not provider in types:
+                    raise TypeError('Unknown type \'{}\'.'.format(provider))
+                make_lock = self._namespace.type_locks[provider]
+                provider = types[provider]
+            # Construct outside of namespace lock
+            obj = provider(*request['args'], **request['kwargs'])
+            instance = id(obj)
+            with self._namespace:
+                self._namespace.add(obj, instance, self, lock=make_lock())
+                self._inst_ids.add(instance)
+        elif 'instance' in request:
+            # Return a named instance
+            instance = request['instance']
+            with self._namespace:
+                if not instance in self._namespace:
+                    raise ValueError('Unknown instance: {}'.format(instance))
+                obj = self._namespace[instance]
+                self._namespace.acquire(instance, self)
+                self._inst_ids.add(instance)
+        else:
+            raise ValueError('Bad open() request. Expected \'instance\' '
+                             'or \'provider\'.')
+        return self._pack_reference(request, obj, instance)
+
+    def _action_close(self, request):
+        """Close action handler.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes: response data
+        """
+        if 'instances' in request:
+            instances = request['instances']
+        else:
+            instances = [request['instance']]
+        unknown = self._release(instances)
+        if unknown:
+            raise KeyError('Instances {} do not exist.'.format(
+                ', '.join(str(instance) for instance in unknown)))
+        return self._pack(request, 'value', None)
+
+    def _release(self, instances):
+        """Release references to instances, in one critical section.
+
+        Args:
+            instances (list): instance ids
+
+        Returns:
+            list: instance ids not referenced by this session
+        """
+        unknown = []
+        released = []
+        with self._namespace:
+            for instance in instances:
+                if not instance in self._inst_ids:
+                    unknown.append(instance)
+                elif self._namespace.release(instance, self):
+                    self._inst_ids.remove(instance)
+                    released.append(instance)
+        # Forget the promises resolved to released instances
+        with self._lock:
+            for instance in released:
+                for request_id in self._promise_ids.pop(instance, ()):
+                    self._promises.pop(request_id, None)
+        return unknown
+
+    def _action_execute(self, request):
+        """Execute action handler.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes: response data
+        """
+        instance = request['instance']
+        with self._namespace:
+            if instance not in self._namespace:
+                raise KeyError('Instance \'{}\' does not exist.'.format(instance))
+            obj = self._namespace[instance]
+            lock = self._namespace.lock(instance)
+        # Only the instance itself is locked while the method runs
+        method = request['method']
+        with lock:
+            ret = call_method(obj, method, request['args'], request['kwargs'])
+        if request.get('oneway'):
+            # No response, so no reference is made
+            return None
+        if method == '__getattr__' and is_method(obj, ret):
+            # Method calls are made by name, no reference needed
+            return self._pack(request, 'method', None)
+        # Unpackable results are told by type without packing them first.
+        # Containers holding unpackable objects are sent with references
+        # to those, packed at once if the method returned such before.
+        call = (type_of(obj), method)
+        packable = CODECS.packable(type(ret))
+        if packable is None and call in self._namespace.unpackable:
+            return self._pack_mixed(request, 'value', ret, lock)
+        if not packable is False:
+            try:
+                return self._pack(request, 'value', ret)
+            except TypeError:
+                if packable is None:
+                    self._namespace.unpackable.add(call)
+                    return self._pack_mixed(request, 'value', ret, lock)
+        instance = id(ret)
+        # Derived objects share the lock of their parent instance
+        with self._namespace:
+            self._namespace.add(ret, instance, self, lock=lock)
+            self._inst_ids.add(instance)
+        return self._pack_reference(request, ret, instance)
+
+    def _action_iterate(self, request):
+        """Iterate action handler. Takes up to 'count' items from an
+        iterator. Objects that are not packable are returned as references.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes: response data
+        """
+        instance = request['instance']
+        with self._namespace:
+            if instance not in self._namespace:
+                raise KeyError('Instance \'{}\' does not exist.'.format(instance))
+            obj = self._namespace[instance]
+            lock = self._namespace.lock(instance)
+        if isinstance(obj, IsolatedInstance):
+            raise TypeError('Iteration of process-isolated instances is not '
+                            'supported.')
+        if not iter(obj) is obj:
+            raise TypeError('Instance \'{}\' is not an iterator.'.format(
+                instance))
+        items = []
+        with lock:
+            items.extend(islice(obj, request['count']))
+        done = len(items) < request['count']
+        try:
+            return self._pack(request, 'items', items, done=done)
+        except TypeError:
+            pass
+        return self._pack_mixed(request, 'items', items, lock, done=done)
+
+    def _action_batch(self, request):
+        """Batch action handler. Handles the 'requests' in order. Their
+        responses are packed one by one and joined behind an array header,
+        rather than unpacked and packed again.
+
+        Args:
+            request (dict): request
+
+        Returns:
+            bytes, list: response data, or chunks of it, see pack_buffers()
+        """
+        responses = [self.handle(sub_request)
+                     for sub_request in request['requests']]
+        # Array data of all responses follows the batch response
+        buffers = []
+        for i, response in enumerate(responses):
+            if isinstance(response, list):
+                responses[i] = response[0]
+                buffers.extend(response[1:])
+        pack = packer()
+        header = [pack.pack_map_header(3 if 'id' in request else 2),
+                  pack.pack('type'), pack.pack('batch')]
+        if 'id' in request:
+            header.extend((pack.pack('id'), pack.pack(request['id'])))
+        header.extend((pack.pack('value'),
+                       pack.pack_array_header(len(responses))))
+        data = b''.join(header + responses)
+        return [data] + buffers if buffers else data
+
+
+def _copy(source, target):
+    """Copy the outcome of a future to another.
+
+    Args:
+        source (Future): done future
+        target (Future): future to complete
+    """
+    try:
+        target.set_result(source.result())
+    except Exception as ex:
+        target.set_exception(ex)
+
+
+_local = local()
+
+
+def packer():
+    """Get the packer of the current thread, packers are not thread-safe.
+
+    Returns:
+        msgpack.Packer: packer
+    """
+    try:
+        return _local.packer
+    except AttributeError:
+        _local.packer = new_packer(default=CODECS.default)
+        return _local.packer
+
+
+def type_of(obj):
+    """Get the type of an instance, that of the object in its process for a
+    process-isolated instance.
+
+    Args:
+        obj (object): instance
+
+    Returns:
+        type: type, None if unknown
+    """
+    return obj.cls if isinstance(obj, IsolatedInstance) else type(obj)
+
+
+def call_method(obj, method, args, kwargs):
+    """Call a method of an object. Calls to a process-isolated instance are
+    forwarded to its process.
+
+    Args:
+        obj (object): instance
+        method (str): method name
+        args (list): positional arguments
+        kwargs (dict): keyword arguments
+
+    Returns:
+        object: returned object
+    """
+    if isinstance(obj, IsolatedInstance):
+        return obj.execute(method, args, kwargs)
+    if method in METHOD_HANDLERS:
+        return METHOD_HANDLERS[method](obj, *args, **kwargs)
+    return getattr(obj, method)(*args, **kwargs)
+
+
+def is_method(obj, attr):
+    """Is an attribute a method bound to its object?
+
+    Args:
+        obj (object): instance
+        attr (object): attribute of instance
+
+    Returns:
+        bool: is a bound method
+    """
+    if attr is BOUND_METHOD:
+        # Attribute of a process-isolated instance
+        return True
+    return callable(attr) and getattr(attr, '__self__', None) is obj
+
+
+METHOD_HANDLERS = {
+    '__getattr__': getattr,
+    '__bool__': bool,
+}
@@ -0,0 +1,452 @@
+from hmac import compare_digest
+import ipaddress
+import os
+import re
+import secrets
+import select
+import socket
+import struct
+import time
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Shared memory is not supported on this platform
+    shared_memory = None
+try:
+    import _posixshmem
+except ImportError:
+    _posixshmem = None
+
+
+# Bytes of each ring buffer, one per direction
+RING_SIZE = 2**23
+# Times a reader polls an empty ring before waiting for a wakeup, none with
+# one CPU, where polling only delays the writer
+SPINS = 100 if (os.cpu_count() or 1) > 1 else 0
+# Seconds a writer waits for a full ring to be read
+FULL_WAIT = 0.0001
+
+# Names of the shared memory of channels, only such is attached
+NAME_PREFIX = 'crouton-'
+_NAME = re.compile(re.escape(NAME_PREFIX) + r'[0-9a-f]{32}\Z')
+# Channel header, before both rings: a magic number and the nonce of the
+# channel, told to the server with the name
+MAGIC = b'crouton\0'
+NONCE_SIZE = 16
+CHANNEL_HEADER = 64
+# Ring header fields, on separate cache lines
+HEAD = 0
+TAIL = 64
+HEADER = 128
+_FIELD = struct.Struct('Q')
+
+
+class Ring:
+
+    def __init__(self, buf, offset, size):
+        """Ring buffer in shared memory, with a single writer and a single
+        reader. The writer advances the head, the reader the tail, both only
+        ever grow.
+
+        Args:
+            buf (memoryview): shared memory
+            offset (int): offset of the ring in buf
+            size (int): data bytes
+        """
+        self._buf = buf
+        self._offset = offset
+        self._data = offset + HEADER
+        self._size = size
+
+    def readable(self):
+        """Get the number of bytes written and not yet read.
+
+        Returns:
+            int: bytes
+        """
+        return self._get(HEAD) - self._get(TAIL)
+
+    def write(self, data):
+        """Write as much of data as fits.
+
+        Args:
+            data (memoryview): bytes
+
+        Returns:
+            int: bytes written
+        """
+        head = self._get(HEAD)
+        count = min(self._size - (head - self._get(TAIL)), len(data))
+        if count:
+            start = self._data + head % self._size
+            first = min(count, self._data + self._size - start)
+            self._buf[start:start + first] = data[:first]
+            if count > first:
+                self._buf[self._data:self._data + count - first] = \
+                    data[first:count]
+            self._set(HEAD, head + count)
+        return count
+
+    def read(self, size):
+        """Read up to size bytes.
+
+        Args:
+            size (int): maximum bytes
+
+        Returns:
+            bytes: bytes read
+        """
+        tail = self._get(TAIL)
+        count = min(self._get(HEAD) - tail, size)
+        start = self._data + tail % self._size
+        first = min(count, self._data + self._size - start)
+        data = self._buf[start:start + first].tobytes()
+        if count > first:
+            data += self._buf[self._data:self._data + count - first].tobytes()
+        self._set(TAIL, tail + count)
+        return data
+
+    def read_into(self, view):
+        """Read up to the size of a buffer into it.
+
+        Args:
+            view (memoryview): buffer
+
+        Returns:
+            int: bytes read
+        """
+        tail = self._get(TAIL)
+        count = min(self._get(HEAD) - tail, len(view))
+        start = self._data + tail % self._size
+        first = min(count, self._data + self._size - start)
+        view[:first] = self._buf[start:start + first]
+        if count > first:
+            view[first:count] = self._buf[self._data:
+                                          self._data + count - first]
+        self._set(TAIL, tail + count)
+        return count
+
+    def _get(self, field):
+        return _FIELD.unpack_from(self._buf, self._offset + field)[0]
+
+    def _set(self, field, value):
+        # Stored whole, struct.pack_into() clears the field first, and the
+        # other end may read it in between
+        start = self._offset + field
+        self._buf[start:start + _FIELD.size].cast('Q')[0] = value
+
+
+class SharedMemoryChannel:
+
+    def __init__(self, sock, memory, size, client):
+        """Connection over two ring buffers in shared memory, one per
+        direction, for a client and server on the same host. Supports the
+        socket methods clients and servers use. The socket of the connection
+        remains to wake a waiting reader and to tell when the peer is gone.
+
+        Each write is followed by a wakeup byte on the socket, sent after
+        the ring's head is stored, and a waiting reader checks the head
+        again after each wakeup it receives. The socket's send and receive
+        order the store before the check, so a reader finding the ring
+        empty is woken by the byte of any later write, and no wakeup is
+        missed. Bytes of writes it has already read only wake it early.
+
+        A channel is made with create() by the client and attach() by the
+        server.
+
+        Args:
+            sock (socket): connected socket
+            memory (SharedMemory): shared memory of both rings
+            size (int): data bytes of each ring
+            client (bool): client end, which writes the first ring
+        """
+        self._socket = sock
+        self._memory = memory
+        self._size = size
+        rings = (Ring(memory.buf, CHANNEL_HEADER, size),
+                 Ring(memory.buf, CHANNEL_HEADER + HEADER + size, size))
+        self._send, self._receive = rings if client else rings[::-1]
+        self._eof = False
+
+    def __del__(self):
+        memory = self.__dict__.get('_memory')
+        if not memory is None:
+            try:
+                memory.close()
+            except BufferError:
+                pass
+
+    @classmethod
+    def create(cls, sock, size=RING_SIZE):
+        """Make the client end of a channel, in new shared memory. Its name
+        and nonce are sent to the server to attach(), and the name unlinked
+        once attached.
+
+        Args:
+            sock (socket): connected socket
+            size (int, optional): data bytes of each ring, default RING_SIZE
+
+        Returns:
+            SharedMemoryChannel: channel
+        """
+        memory = shared_memory.SharedMemory(
+            NAME_PREFIX + secrets.token_hex(16), create=True,
+            size=_memory_size(size))
+        _untrack(memory)
+        memory.buf[:len(MAGIC) + NONCE_SIZE] = \
+            MAGIC + secrets.token_bytes(NONCE_SIZE)
+        return cls(sock, memory, size, True)
+
+    @classmethod
+    def attach(cls, sock, name, size, nonce):
+        """Make the server end of a channel, in the shared memory made by
+        the client. Only shared memory named like that of a channel, owned
+        by the user of the client and accessible by that user only, is
+        mapped, and it must hold the nonce of the channel. So a client can
+        not have the server use shared memory of others.
+
+        Args:
+            sock (socket): connected socket
+            name (str): shared memory name
+            size (int): data bytes of each ring
+            nonce (bytes): nonce of the channel
+
+        Returns:
+            SharedMemoryChannel: channel
+
+        Raises:
+            PermissionError: If the shared memory is not the client's
+                channel.
+            ValueError: If the shared memory is too small.
+        """
+        if not isinstance(name, str) or not _NAME.match(name):
+            raise PermissionError('Not the shared memory of a channel.')
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError('size: Expected a positive integer.')
+        uid = peer_uid(sock)
+        owner = _owner(name, uid)
+        memory = shared_memory.SharedMemory(name)
+        try:
+            _untrack(memory)
+            # The same shared memory as checked, not one made since
+            if not owner is None and _owner(name, uid, memory._fd) != owner:
+                raise PermissionError('Shared memory was replaced.')
+            if memory.size < _memory_size(size):
+                raise ValueError('Shared memory too small.')
+            header = bytes(memory.buf[:len(MAGIC) + NONCE_SIZE])
+            if not isinstance(nonce, bytes) or \
+                    not compare_digest(header, MAGIC + nonce):
+                raise PermissionError('Shared memory does not hold the '
+                                      'nonce of the channel.')
+        except BaseException:
+            memory.close()
+            raise
+        return cls(sock, memory, size, False)
+
+    @property
+    def name(self):
+        """Name of the shared memory.
+
+        Returns:
+            str: name
+        """
+        return self._memory.name
+
+    @property
+    def nonce(self):
+        """Nonce of the channel, held by its shared memory.
+
+        Returns:
+            bytes: nonce
+        """
+        return bytes(self._memory.buf[len(MAGIC):len(MAGIC) + NONCE_SIZE])
+
+    def unlink(self):
+        """Remove the name of the shared memory, which is freed once both
+        ends are closed.
+        """
+        # Unlinking stops the tracking
+        _track(self._memory)
+        self._memory.unlink()
+
+    def sendall(self, data):
+        """Send all data, waking the reader after each write.
+
+        Args:
+            data (bytes-like): data
+
+        Raises:
+            ConnectionError: If the connection is closed.
+        """
+        view = memoryview(data).cast('B')
+        while len(view):
+            count = self._send.write(view)
+            if count:
+                view = view[count:]
+                # Blocks only while the reader's socket buffer is full of
+                # wakeups, the reader drains them once it has read the ring
+                self._socket.sendall(b'\0')
+            elif select.select([self._socket], [], [], FULL_WAIT)[0]:
+                # Wakeups for this end's reader, or the peer is gone
+                if not self._socket.recv(1, socket.MSG_PEEK):
+                    raise ConnectionError('Connection closed.')
+                time.sleep(FULL_WAIT)
+
+    def recv(self, size):
+        """Receive data.
+
+        Args:
+            size (int): maximum bytes
+
+        Returns:
+            bytes: data, empty once the connection is closed
+        """
+        if not self._wait():
+            return b''
+        return self._receive.read(size)
+
+    def recv_into(self, view):
+        """Receive data into a buffer.
+
+        Args:
+            view (memoryview): buffer
+
+        Returns:
+            int: bytes received, 0 once the connection is closed
+        """
+        if not self._wait():
+            return 0
+        return self._receive.read_into(view)
+
+    def shutdown(self, how):
+        self._socket.shutdown(how)
+
+    def close(self):
+        """Close the connection. The shared memory is closed once the
+        channel is no longer used.
+        """
+        self._socket.close()
+
+    def _wait(self):
+        """Wait for data to receive. Polls briefly, then waits for a wakeup
+        through the socket, checking the ring again after each.
+
+        Returns:
+            bool: False if the connection is closed and all data received
+        """
+        spins = 0
+        while not self._receive.readable():
+            if self._eof:
+                return False
+            if spins < SPINS:
+                spins += 1
+                time.sleep(0)
+                continue
+            try:
+                # Wakeups of all writes so far, including those read
+                if not self._socket.recv(4096):
+                    self._eof = True
+            except (OSError, ValueError):
+                # Closed by this end
+                self._eof = True
+        return True
+
+
+def _track(memory):
+    """Track shared memory, to be unlinked when this process exits."""
+    if os.name == 'posix':
+        resource_tracker.register(memory._name, 'shared_memory')
+
+
+def _untrack(memory):
+    """Stop tracking shared memory. Shared memory is tracked from when it
+    is made or attached, and the tracker fails to unregister it twice, so
+    both ends of a channel stop tracking at once, and the client tracks it
+    again to unlink it."""
+    if os.name == 'posix':
+        resource_tracker.unregister(memory._name, 'shared_memory')
+
+
+def peer_uid(sock):
+    """Get the user of the peer of a connected socket, known for Unix
+    domain sockets. Peers of other sockets are taken to be of this
+    process's user.
+
+    Args:
+        sock (socket): connected socket
+
+    Returns:
+        int: user id, None where users are not known
+    """
+    if not hasattr(os, 'getuid'):
+        return None
+    if sock.family == getattr(socket, 'AF_UNIX', None) and \
+            hasattr(socket, 'SO_PEERCRED'):
+        creds = struct.Struct('3i')
+        _, uid, _ = creds.unpack(sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size))
+        return uid
+    return os.getuid()
+
+
+def _owner(name, uid, fd=None):
+    """Check that shared memory is owned by a user and accessible by that
+    user only, before mapping it.
+
+    Args:
+        name (str): shared memory name
+        uid (int): user id, None where users are not known
+        fd (int, optional): file descriptor of the shared memory, default
+            None to open it by name
+
+    Returns:
+        tuple: device and inode of the shared memory, None where users are
+            not known
+
+    Raises:
+        PermissionError: If the shared memory is of another user, or
+            accessible by others.
+    """
+    if uid is None or _posixshmem is None:
+        return None
+    if fd is None:
+        opened = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0)
+        try:
+            stat = os.fstat(opened)
+        finally:
+            os.close(opened)
+    else:
+        stat = os.fstat(fd)
+    if stat.st_uid != uid or stat.st_mode & 0o077:
+        raise PermissionError('Shared memory is not the client\'s.')
+    return stat.st_dev, stat.st_ino
+
+
+def _memory_size(size):
+    """Get the bytes of the shared memory of a channel."""
+    return CHANNEL_HEADER + 2 * (HEADER + size)
+
+
+def is_local(sock):
+    """Is the peer of a connected socket on the same host, so shared memory
+    can be used?
+
+    Args:
+        sock (socket): connected socket, or other connection
+
+    Returns:
+        bool: on the same host
+    """
+    if shared_memory is None or not isinstance(sock, socket.socket):
+        # Connections of other transports are already as fast
+        return False
+    if sock.family == getattr(socket, 'AF_UNIX', None):
+        return True
+    try:
+        peer = sock.getpeername()[0]
+        return ipaddress.ip_address(peer).is_loopback or \
+            peer == sock.getsockname()[0]
+    except (OSError, ValueError, IndexError, TypeError):
+        # Not an IP socket
+        return False
+
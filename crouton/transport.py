@@ -0,0 +1,414 @@
+import asyncio
+import errno
+import os
+import socket
+from urllib.parse import parse_qsl, urlsplit
+from . import inproc
+
+
+# Transport types by URL scheme
+TRANSPORTS = {}
+
+
+class Transport:
+
+    # Option parsers by name, for options given in the query of a URL
+    OPTIONS = {}
+    # Listens once, before forking server processes, which share the
+    # listener. Otherwise each process listens itself, see listen().
+    shared = True
+
+    def __init__(self, sndbuf=None, rcvbuf=None):
+        """Base of the ways clients connect to servers, made from a URL with
+        transport(). The connections are sockets, or objects supporting the
+        socket methods clients and servers use.
+
+        Args:
+            sndbuf (int, optional): SO_SNDBUF bytes, default None for the
+                system's default
+            rcvbuf (int, optional): SO_RCVBUF bytes, default None for the
+                system's default
+        """
+        self._sndbuf = sndbuf
+        self._rcvbuf = rcvbuf
+
+    @classmethod
+    def from_url(cls, parts, **options):
+        """Make a transport from the parts of its URL.
+
+        Args:
+            parts (SplitResult): URL, split by urlsplit()
+            **options: options of the transport
+
+        Returns:
+            Transport: transport
+        """
+        raise NotImplementedError
+
+    def listen(self, reuse_port=False):
+        """Listen for connections.
+
+        Args:
+            reuse_port (bool, optional): share the address with other server
+                processes, each listening itself
+
+        Returns:
+            socket: listener, supporting fileno(), accept(), getsockname()
+                and close()
+        """
+        raise NotImplementedError
+
+    def accept(self, listener):
+        """Accept a connection from a listener made by listen().
+
+        Args:
+            listener (socket): listener
+
+        Returns:
+            tuple: connection and its address, for logging
+        """
+        sock, address = listener.accept()
+        # Listeners do not block, see Server._run_threads()
+        sock.setblocking(True)
+        self.configure(sock)
+        return sock, address
+
+    def close(self, listener):
+        """Stop listening.
+
+        Args:
+            listener (socket): listener made by listen()
+        """
+        listener.close()
+
+    def connect(self):
+        """Connect to a server.
+
+        Returns:
+            socket: connection
+        """
+        raise NotImplementedError
+
+    async def open_connection(self):
+        """Connect to a server, from an asyncio event loop.
+
+        Returns:
+            tuple: StreamReader and StreamWriter of the connection
+        """
+        raise NotImplementedError
+
+    async def start_server(self, callback, listener):
+        """Serve connections from a listener made by listen(), on the
+        running event loop.
+
+        Args:
+            callback (coroutine function): called with the StreamReader and
+                StreamWriter of each connection
+            listener (socket): listener
+
+        Returns:
+            asyncio.Server: server
+        """
+        async def connection(reader, writer):
+            self.configure(writer.get_extra_info('socket'))
+            await callback(reader, writer)
+        return await asyncio.start_server(connection, sock=listener,
+                                          backlog=socket.SOMAXCONN)
+
+    def configure(self, sock):
+        """Set the socket options of a connection.
+
+        Args:
+            sock (socket): connection
+        """
+        if not self._sndbuf is None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sndbuf)
+        if not self._rcvbuf is None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf)
+
+
+class TcpTransport(Transport):
+
+    OPTIONS = {
+        'nodelay': lambda value: _flag(value),
+        'keepalive': lambda value: _flag(value),
+        'sndbuf': int,
+        'rcvbuf': int,
+    }
+    shared = False
+
+    def __init__(self, host, port, nodelay=True, keepalive=False,
+                 sndbuf=None, rcvbuf=None):
+        """TCP transport, 'tcp://host:port'.
+
+        Args:
+            host (str): host address
+            port (int): port number
+            nodelay (bool, optional): send small messages at once, without
+                waiting to coalesce them (TCP_NODELAY), default True
+            keepalive (bool, optional): probe idle connections, to tell
+                when the peer is gone (SO_KEEPALIVE), default False
+            sndbuf (int, optional): SO_SNDBUF bytes, default None for the
+                system's default
+            rcvbuf (int, optional): SO_RCVBUF bytes, default None for the
+                system's default
+        """
+        super().__init__(sndbuf, rcvbuf)
+        self.host = host
+        self.port = port
+        self._nodelay = nodelay
+        self._keepalive = keepalive
+
+    def __str__(self):
+        return 'tcp://{}:{}'.format(self.host, self.port)
+
+    @classmethod
+    def from_url(cls, parts, **options):
+        if parts.port is None:
+            raise ValueError('url: Expected a port.')
+        return cls(parts.hostname or 'localhost', parts.port, **options)
+
+    def listen(self, reuse_port=False):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            # Buffer sizes are inherited by accepted connections
+            super().configure(sock)
+            sock.bind((self.host, self.port))
+            sock.listen(socket.SOMAXCONN)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # Set before connecting, as the window is agreed on connecting
+            self.configure(sock)
+            sock.connect((self.host, self.port))
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def open_connection(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.configure(writer.get_extra_info('socket'))
+        return reader, writer
+
+    def configure(self, sock):
+        super().configure(sock)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                        int(self._nodelay))
+        if self._keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+class UnixTransport(Transport):
+
+    OPTIONS = {
+        'sndbuf': int,
+        'rcvbuf': int,
+    }
+
+    def __init__(self, path, sndbuf=None, rcvbuf=None):
+        """Unix domain socket transport, 'unix:///path/of/socket'.
+
+        Args:
+            path (str): path of the socket
+            sndbuf (int, optional): SO_SNDBUF bytes, default None for the
+                system's default
+            rcvbuf (int, optional): SO_RCVBUF bytes, default None for the
+                system's default
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise NotImplementedError('path: Requires Unix domain sockets.')
+        super().__init__(sndbuf, rcvbuf)
+        self.path = path
+
+    def __str__(self):
+        return 'unix://{}'.format(self.path)
+
+    @classmethod
+    def from_url(cls, parts, **options):
+        path = parts.netloc + parts.path
+        if not path:
+            raise ValueError('url: Expected a path.')
+        return cls(path, **options)
+
+    def listen(self, reuse_port=False):
+        """Listen for connections. A socket file left by a server that is
+        no longer running is replaced.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.configure(sock)
+            try:
+                sock.bind(self.path)
+            except OSError as ex:
+                if ex.errno != errno.EADDRINUSE:
+                    raise
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.path)
+                except ConnectionRefusedError:
+                    os.unlink(self.path)
+                finally:
+                    probe.close()
+                sock.bind(self.path)
+            sock.listen(socket.SOMAXCONN)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def accept(self, listener):
+        sock, _ = super().accept(listener)
+        # Clients are unnamed
+        return sock, self.path
+
+    def close(self, listener):
+        """Stop listening, removing the socket file."""
+        super().close(listener)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.configure(sock)
+            sock.connect(self.path)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def open_connection(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self.configure(writer.get_extra_info('socket'))
+        return reader, writer
+
+
+class InprocTransport(Transport):
+
+    shared = False
+
+    def __init__(self, name):
+        """In-process transport, 'inproc://name'. Connects clients to a
+        server in the same process through queues in memory, so calls take
+        the full protocol path without the cost of sockets. Served by the
+        'thread' engine, from the process that listens.
+
+        Args:
+            name (str): name of the listener
+        """
+        super().__init__()
+        self.name = name
+
+    def __str__(self):
+        return 'inproc://{}'.format(self.name)
+
+    @classmethod
+    def from_url(cls, parts, **options):
+        name = parts.netloc + parts.path
+        if not name:
+            raise ValueError('url: Expected a name.')
+        return cls(name, **options)
+
+    def listen(self, reuse_port=False):
+        if reuse_port:
+            raise NotImplementedError('inproc: Can not be served by forked '
+                                      'processes.')
+        return inproc.Listener(self.name)
+
+    def accept(self, listener):
+        conn, _ = listener.accept()
+        return conn, str(self)
+
+    def connect(self):
+        return inproc.connect(self.name)
+
+    async def open_connection(self):
+        raise NotImplementedError('inproc: Requires Client.')
+
+    async def start_server(self, callback, listener):
+        raise NotImplementedError('inproc: Requires the \'thread\' engine.')
+
+
+def register_transport(scheme, cls):
+    """Register a transport type by URL scheme, for both Server and Client.
+
+    Args:
+        scheme (str): URL scheme, e.g. 'tcp'
+        cls (type): Transport subclass, made with its from_url()
+    """
+    if scheme in TRANSPORTS:
+        raise KeyError('A transport by scheme \'{}\' already exists.'.format(
+            scheme))
+    TRANSPORTS[scheme] = cls
+
+
+def transport(url, **options):
+    """Make a transport from a URL. Options are given in the query of the
+    URL, e.g. 'tcp://localhost:5000?nodelay=0&sndbuf=1048576', or as keyword
+    arguments, which take precedence.
+
+    Args:
+        url (str, Transport): URL, or a transport, returned as is
+        **options: options of the transport
+
+    Returns:
+        Transport: transport
+
+    Raises:
+        ValueError: If the scheme or an option is unknown.
+    """
+    if isinstance(url, Transport):
+        return url
+    parts = urlsplit(url)
+    cls = TRANSPORTS.get(parts.scheme)
+    if cls is None:
+        raise ValueError('url: Unknown scheme \'{}\'.'.format(parts.scheme))
+    parsed = {}
+    for name, value in parse_qsl(parts.query):
+        if not name in cls.OPTIONS:
+            raise ValueError('url: Unknown option \'{}\'.'.format(name))
+        parsed[name] = cls.OPTIONS[name](value)
+    parsed.update(options)
+    return cls.from_url(parts, **parsed)
+
+
+def client_transport(host, port, path=None, url=None):
+    """Make the transport a client connects through, from its arguments.
+
+    Args:
+        host (str): host
+        port (int): TCP port number
+        path (str, optional): path of a Unix domain socket, instead of host
+            and port
+        url (str, Transport, optional): URL of a transport, instead of all
+            others
+
+    Returns:
+        Transport: transport
+    """
+    if not url is None:
+        return transport(url)
+    if not path is None:
+        return UnixTransport(path)
+    return TcpTransport(host, port)
+
+
+def _flag(value):
+    """Parse a flag option, '1', 'true', 'yes' or 'on' for True."""
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+register_transport('tcp', TcpTransport)
+register_transport('unix', UnixTransport)
+register_transport('inproc', InprocTransport)
@@ -0,0 +1,82 @@
+"""Tests for codec functions.
+
+This module contains unit-tests for the codec functions.
+"""
+
+from crouton.codec import CODECS, EXT_DECIMAL, Reference, decode_error, \
+    encode_reference, ext_hook, new_packer, new_unpacker, pack_buffers, \
+    receive_buffers, resolve
+import unittest
+import datetime
+import msgpack
+from collections import OrderedDict
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class CodecTestCase(unittest.TestCase):
+
+    def test_packable(self):
+        self.assertTrue(CODECS.packable(int))
+        self.assertTrue(CODECS.packable(datetime.datetime))
+        self.assertIsNone(CODECS.packable(OrderedDict))
+        self.assertFalse(CODECS.packable(object))
+
+    def test_references(self):
+        packer = new_packer()
+        unpacker = new_unpacker(ext_hook=ext_hook)
+        unpacker.feed(packer.pack([
+            1,
+            encode_reference(10),
+            {'key': encode_reference(11, 2, {'name': 'Type'})},
+        ]))
+        obj = next(unpacker)
+        self.assertEqual(obj[1], Reference(10))
+        reference = obj[2]['key']
+        self.assertEqual((reference.instance, reference.schema,
+                          reference.schema_def), (11, 2, {'name': 'Type'}))
+        self.assertEqual(resolve(obj, lambda reference: reference.instance),
+                         [1, 10, {'key': 11}])
+
+    def test_sets(self):
+        packer = new_packer(CODECS.default)
+        unpacker = new_unpacker(ext_hook=ext_hook)
+        values = [{(1, 2), (3, (4, 5))}, frozenset({(1, 2), 'a'})]
+        unpacker.feed(packer.pack(values))
+        self.assertEqual(next(unpacker), values)
+        self.assertIsNone(decode_error())
+
+    def test_decode_error(self):
+        unpacker = new_unpacker(ext_hook=ext_hook)
+        unpacker.feed(new_packer().pack([msgpack.ExtType(EXT_DECIMAL, b'?'),
+                                         1]))
+        unpacker.feed(new_packer().pack(2))
+        # The object decodes without it, and the stream remains intact
+        self.assertEqual(next(unpacker), [None, 1])
+        self.assertIn('Traceback', decode_error())
+        self.assertIsNone(decode_error())
+        self.assertEqual(next(unpacker), 2)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_scalars(self):
+        scalars = [numpy.float32(2.5), numpy.int32(-5), numpy.int16(7)]
+        # Scalars are sent in band, only arrays out of band
+        data = pack_buffers(new_packer(CODECS.default), scalars)
+        self.assertIsInstance(data, bytes)
+        data = pack_buffers(new_packer(CODECS.default), [numpy.arange(3)] + scalars)
+        self.assertIsInstance(data, list)
+        unpacker = new_unpacker(ext_hook=ext_hook)
+        unpacker.feed(b''.join(data))
+        # Values are taken from new memory, not yet received into
+        obj = next(unpacker)
+        self.assertEqual(receive_buffers(unpacker), [])
+        self.assertEqual(obj[1:], scalars)
+        self.assertEqual([type(item) for item in obj[1:]],
+                         [type(item) for item in scalars])
+        self.assertTrue(numpy.array_equal(obj[0], numpy.arange(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
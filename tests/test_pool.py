@@ -0,0 +1,80 @@
+"""Tests for ThreadPool object.
+
+This module contains unit-tests for the ThreadPool object.
+"""
+
+from crouton.server.pool import ThreadPool
+import unittest
+import time
+from threading import Barrier, Event, Lock
+
+
+class ThreadPoolTestCase(unittest.TestCase):
+
+    def test_bounded(self):
+        pool = ThreadPool(max_workers=3, idle_timeout=0.1)
+        lock = Lock()
+        running = [0, 0]
+        # Each work waits for two others, so three run at once
+        barrier = Barrier(3, timeout=5)
+
+        def work():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            barrier.wait()
+            with lock:
+                running[0] -= 1
+            return True
+
+        futures = [pool.submit(work) for _ in range(30)]
+        self.assertTrue(all(future.result() for future in futures))
+        self.assertEqual(running[1], 3)
+        self.assertLessEqual(pool.size, 3)
+        # Idle threads exit
+        _wait_until(lambda: pool.size == 0)
+        pool.shutdown()
+
+    def test_min_workers(self):
+        pool = ThreadPool(min_workers=2, max_workers=4, idle_timeout=0.05)
+        self.assertEqual(pool.size, 2)
+        release = Event()
+        futures = [pool.submit(release.wait) for _ in range(4)]
+        _wait_until(lambda: pool.size == 4)
+        release.set()
+        for future in futures:
+            future.result()
+        # Idle threads exit, down to min_workers
+        _wait_until(lambda: pool.size == 2)
+        pool.shutdown()
+        self.assertEqual(pool.size, 0)
+        with self.assertRaises(RuntimeError):
+            pool.submit(time.sleep, 0)
+
+    def test_exception(self):
+        with ThreadPool() as pool:
+            with self.assertRaises(ZeroDivisionError):
+                pool.submit(lambda: 1 / 0).result()
+        with self.assertRaises(ValueError):
+            ThreadPool(min_workers=2, max_workers=1)
+
+
+def _wait_until(condition, timeout=5.0):
+    """Wait for a condition to hold, e.g. for idle threads to exit.
+
+    Args:
+        condition (callable): returns whether the condition holds
+        timeout (float, optional): seconds to wait before failing
+
+    Raises:
+        AssertionError: If the condition does not hold in time.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Condition not met in time.')
+        time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
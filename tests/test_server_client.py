@@ -3,20 +3,51 @@
 This module contains unit-tests for the Server & client object.
 """
 
-from crouton import Server, Client
+from crouton import Server, Client, AsyncClient, register_codec
+from crouton.client import Flusher, Method, RemoteError, RELEASE_BATCH
+from crouton.inproc import Connection
+from crouton.server.server import Worker
+from crouton.shm import RING_SIZE, SharedMemoryChannel
+from concurrent.futures import wait
 import unittest
-from threading import Thread
+import asyncio
+import gc
+import datetime
+import decimal
+import uuid
+import time
+import os
+import socket
+import tempfile
+from threading import Barrier, Event, Thread, current_thread, \
+    enumerate as enumerate_threads
+from unittest import mock
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 HOST = 'localhost'
 PORT = 5002
+PATH = os.path.join(tempfile.gettempdir(), 'crouton-test.sock')
+INPROC = 'inproc://crouton-test'
+# Barriers and events of TestObject.meet() and hold(), by [name]
+BARRIERS = {}
+EVENTS = {}
 
 
 class ServerClientTestCase(unittest.TestCase):
 
+    engine = 'thread'
+
     def setUp(self):
         self._server = Server()
-        kwargs = {'host': HOST, 'port': PORT}
+        kwargs = {'host': HOST, 'port': PORT, 'engine': self.engine}
+        if hasattr(socket, 'AF_UNIX'):
+            kwargs['path'] = PATH
+        if self.engine == 'thread':
+            kwargs['url'] = INPROC
         self._server_thread = Thread(target=self._server.run, kwargs=kwargs)
         self._server_thread.start()
         self._server._wait_for()
@@ -28,8 +59,9 @@ class ServerClientTestCase(unittest.TestCase):
         del self._client
         # Connect once more to get the server to shutdown. This is just a
         # hack for unit-test flow, since server is blocking on accept().
-        cli = Client(host=HOST, port=PORT)
-        del cli
+        if self.engine == 'thread':
+            cli = Client(host=HOST, port=PORT)
+            del cli
         self._server_thread.join()
 
     def test_list(self):
@@ -65,6 +97,671 @@ class ServerClientTestCase(unittest.TestCase):
         print(obj.arg1)
         with obj as obj1:
             print(obj1)
+        self.assertIsNone(obj.exit_type)
+        # The remote object is told of a failure
+        with self.assertRaises(ValueError):
+            with obj:
+                raise ValueError('failed')
+        self.assertEqual((obj.exit_type, obj.exit_value),
+                         ('ValueError', 'failed'))
+
+    def test_method(self):
+        self._server.register_type(TestObject)
+        obj = self._client.factory('TestObject', 'first arg')
+        instances = len(self._server._namespace._instances)
+        self.assertIsInstance(obj.getpid, Method)
+        for _ in range(3):
+            self.assertEqual(obj.getpid(), os.getpid())
+        # No references to bound methods are made
+        self.assertEqual(len(self._server._namespace._instances), instances)
+        self.assertEqual(obj.arg1, 'first arg')
+
+    def test_schema(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(list)
+        obj = self._client.factory('TestObject', 'first arg')
+        self.assertEqual(type(obj).__name__, 'TestObject')
+        # Methods are resolved without requests
+        self._client._socket, sock = None, self._client._socket
+        try:
+            self.assertIsInstance(obj.getpid, Method)
+            # Operations of other types fail locally
+            with self.assertRaises(TypeError):
+                len(obj)
+            with self.assertRaises(TypeError):
+                obj + 1
+        finally:
+            self._client._socket = sock
+        self.assertEqual(obj.arg1, 'first arg')
+        objs = [self._client.factory(list) for _ in range(2)]
+        self.assertIs(type(objs[0]), type(objs[1]))
+        objs[0].append(1)
+        self.assertEqual(len(objs[0]), 1)
+        with self.assertRaises(TypeError):
+            hash(objs[0])
+
+    def test_release(self):
+        self._server.register_type(list)
+        namespace = self._server._namespace
+        obj = self._client.factory(list)
+        instances = len(namespace._instances)
+        for _ in range(10):
+            self._client.factory(list)
+        # Released with the next request
+        self.assertEqual(len(namespace._instances), instances + 1)
+        len(obj)
+        self.assertEqual(len(namespace._instances), instances)
+        # Released once enough are queued, the flusher is told at once
+        flusher = self._client._flusher
+        self._client._flusher = mock.Mock(wraps=flusher)
+        try:
+            objs = [self._client.factory(list) for _ in range(100)]
+            del objs
+            self._client._flusher.notify.assert_called_once_with(
+                self._client)
+        finally:
+            self._client._flusher = flusher
+        _wait_until(lambda: len(namespace._instances) < instances + 64)
+        # Released after a while
+        self._client.factory(list)
+        _wait_until(lambda: len(namespace._instances) == instances)
+        # By one thread for all clients
+        clients = [Client(host=HOST, port=PORT) for _ in range(4)]
+        self.assertEqual(sum(isinstance(thread, Flusher)
+                             for thread in enumerate_threads()), 1)
+        del clients
+
+    def test_iterate(self):
+        self._server.register_type(list)
+        self._server.register_type(TestObject)
+        obj = self._client.factory(list)
+        pipe = self._client.pipeline()
+        for i in range(5000):
+            pipe.execute(obj, 'append', i)
+        pipe.collect()
+        self.assertEqual(list(obj), list(range(5000)))
+        self.assertEqual(sum(1 for _ in iter(obj)), 5000)
+        # Unpackable items are returned as references
+        test_obj = self._client.factory('TestObject', 'first arg')
+        namespace = self._server._namespace
+        instances = len(namespace._instances)
+        self.assertEqual([item.arg1 for item in test_obj.objects(20)],
+                         list(range(20)))
+        for item in test_obj.objects(100):
+            break
+        del item
+        gen = test_obj.objects(2)
+        self.assertEqual(next(gen).arg1, 0)
+        del gen
+        # Released after a while, including references in discarded batches
+        _wait_until(lambda: len(namespace._instances) == instances)
+
+    def test_reference_arguments(self):
+        self._server.register_type(list)
+        self._server.register_type(TestObject)
+        a = self._client.factory(list)
+        b = self._client.factory(list)
+        obj = self._client.factory('TestObject', 'first arg')
+        a.append(1)
+        b.append(1)
+        self.assertTrue(a == b)
+        # Passed without copying, also nested
+        a.append(obj)
+        a.append([obj, {'key': obj}])
+        self.assertEqual(a[1].arg1, 'first arg')
+        self.assertEqual(a[2][1]['key'].arg1, 'first arg')
+        obj.arg1 = 'changed'
+        self.assertEqual(a[1].arg1, 'changed')
+        other = Client(host=HOST, port=PORT)
+        with self.assertRaises(TypeError):
+            other.factory(list).append(obj)
+        del other
+
+    def test_unpackable(self):
+        self._server.register_type(list)
+        self._server.register_type(TestObject)
+        namespace = self._server._namespace
+        a = self._client.factory(list)
+        a.extend(list(range(1000)))
+        instances = len(namespace._instances)
+        a.append(self._client.factory('TestObject', 'first arg'))
+        a.append({'key': [a[-1]]})
+        # Returned by value with references to unpackable objects, first
+        # after packing fails, then at once
+        for _ in range(2):
+            copy = a.copy()
+            self.assertIsInstance(copy, list)
+            self.assertEqual(copy[:1000], list(range(1000)))
+            self.assertEqual(copy[1000].arg1, 'first arg')
+            self.assertEqual(copy[1001]['key'][0].arg1, 'first arg')
+        # Packable results of the same method are still packed at once
+        a.pop()
+        a.pop()
+        self.assertEqual(a.copy(), list(range(1000)))
+        del copy
+        _wait_until(lambda: len(namespace._instances) == instances)
+
+    def test_codecs(self):
+        self._server.register_type(dict)
+        obj = self._client.factory(dict)
+        values = {
+            'datetime': datetime.datetime.now(datetime.timezone.utc),
+            'date': datetime.date.today(),
+            'time': datetime.time(12, 30, 15, 500),
+            'timedelta': datetime.timedelta(days=-1, microseconds=5),
+            'decimal': decimal.Decimal('1.10'),
+            'uuid': uuid.uuid4(),
+            'set': {1, 'a', frozenset((2, 3))},
+            'tuples': {(1, 2), (3, (4, 5))},
+            'frozen tuples': frozenset({(1, 2)}),
+            'complex': 1 - 2j,
+            'point': Point(1, 2),
+        }
+        for key, value in values.items():
+            obj[key] = value
+        # Returned by value
+        for key, value in values.items():
+            self.assertEqual(obj[key], value)
+        self.assertEqual(obj.copy(), values)
+
+    def test_undecodable(self):
+        self._server.register_type(list)
+        self._server.register_type(Unreadable)
+        obj = self._client.factory(list)
+        # Fails the request, not the connection
+        with self.assertRaises(RemoteError):
+            obj.append(Unreadable())
+        self.assertEqual(len(obj), 0)
+        unreadable = self._client.factory(Unreadable)
+        with self.assertRaises(RemoteError):
+            unreadable.itself()
+        self.assertEqual(len(obj), 0)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_arrays(self):
+        self._server.register_type(dict)
+        obj = self._client.factory(dict)
+        arrays = {
+            'large': numpy.random.rand(1024, 1024),
+            'strided': numpy.arange(100, dtype='>i4')[::3],
+            'scalar': numpy.int16(7),
+            'float scalar': numpy.float32(2.5),
+            'negative scalar': numpy.int32(-5),
+            'empty': numpy.zeros((0, 3)),
+            'datetime': numpy.array(['2020-01-01'], dtype='M8[D]'),
+        }
+        for key, value in arrays.items():
+            obj[key] = value
+        for key, value in arrays.items():
+            ret = obj[key]
+            self.assertEqual(ret.dtype, value.dtype)
+            self.assertTrue(numpy.array_equal(ret, value))
+        # Received arrays are writable
+        obj['large'][0, 0] = 1
+        with self._client.batch():
+            futures = [obj.get(key) for key in ('large', 'strided')]
+        self.assertTrue(numpy.array_equal(futures[0].result(),
+                                          arrays['large']))
+        self.assertTrue(numpy.array_equal(futures[1].result(),
+                                          arrays['strided']))
+
+        async def run():
+            async with await AsyncClient.connect(HOST, PORT) as client:
+                obj = await client.factory(dict)
+                await obj.__setitem__('large', arrays['large'])
+                return await obj['large']
+        ret = asyncio.run(run())
+        self.assertTrue(numpy.array_equal(ret, arrays['large']))
+
+    def test_shared_memory(self):
+        self._server.register_type(list)
+        client = Client(host=HOST, port=PORT, shared_memory=True)
+        # The asyncio engine keeps clients on TCP
+        self.assertEqual(
+            isinstance(client._socket, SharedMemoryChannel),
+            self.engine == 'thread')
+        data = os.urandom(2 * RING_SIZE + 1)
+        obj = client.factory(list)
+        obj.append(data)
+        self.assertEqual(obj[0], data)
+        # Not used unless asked for
+        self.assertNotIsInstance(self._client._socket, SharedMemoryChannel)
+        obj = self._client.factory(list)
+        obj.append(data)
+        self.assertEqual(obj[0], data)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'),
+                         'Requires Unix domain sockets.')
+    def test_unix_socket(self):
+        self._server.register_type(list)
+        client = Client(path=PATH)
+        self.assertEqual(client._socket.family, socket.AF_UNIX)
+        obj = client.factory(list)
+        obj.append(1)
+        self.assertEqual(len(obj), 1)
+        # Shared memory is woken through the Unix domain socket
+        client = Client(path=PATH, shared_memory=True)
+        self.assertEqual(
+            isinstance(client._socket, SharedMemoryChannel),
+            self.engine == 'thread')
+        self.assertEqual(client.factory(list, [1, 2])[1], 2)
+
+        async def run():
+            async with await AsyncClient.connect(path=PATH) as client:
+                obj = await client.factory(list)
+                await obj.append(1)
+                return await obj.__len__()
+        self.assertEqual(asyncio.run(run()), 1)
+
+    def test_url(self):
+        self._server.register_type(list)
+        client = Client(host=HOST, port=PORT)
+        self.assertTrue(client._socket.getsockopt(socket.IPPROTO_TCP,
+                                                  socket.TCP_NODELAY))
+        client = Client(url='tcp://{}:{}?nodelay=0'.format(HOST, PORT))
+        self.assertFalse(client._socket.getsockopt(socket.IPPROTO_TCP,
+                                                   socket.TCP_NODELAY))
+        self.assertEqual(client.factory(list, [1, 2])[1], 2)
+
+        async def run():
+            url = 'tcp://{}:{}?keepalive=1'.format(HOST, PORT)
+            async with await AsyncClient.connect(url=url) as client:
+                obj = await client.factory(list)
+                await obj.append(1)
+                return await obj.__len__()
+        self.assertEqual(asyncio.run(run()), 1)
+
+    def test_inproc(self):
+        if self.engine != 'thread':
+            self.skipTest('inproc requires the thread engine')
+        self._server.register_type(list)
+        client = Client(url=INPROC)
+        self.assertIsInstance(client._socket, Connection)
+        obj = client.factory(list)
+        data = bytes(2**20 + 1)
+        obj.append(data)
+        self.assertEqual(obj[0], data)
+        with client.batch():
+            for i in range(100):
+                obj.append(i)
+        self.assertEqual(len(obj), 101)
+        with self.assertRaises(ConnectionRefusedError):
+            Client(url='inproc://crouton-none')
+
+    def test_pipeline(self):
+        self._server.register_type(list)
+        obj = self._client.factory(list)
+        pipe = self._client.pipeline(window=8)
+        for i in range(100):
+            pipe.execute(obj, 'append', i)
+            pipe.execute(obj, '__len__')
+        self.assertEqual(len(pipe), 200)
+        results = pipe.collect()
+        self.assertEqual(results[1::2], list(range(1, 101)))
+        self.assertEqual(len(pipe), 0)
+        pipe.execute(obj, 'pop', 1000)
+        pipe.execute(obj, 'pop')
+        with self.assertRaises(RemoteError):
+            pipe.collect()
+        pipe.execute(obj, 'pop', 1000)
+        pipe.execute(obj, 'pop')
+        results = pipe.collect(raise_on_error=False)
+        self.assertIsInstance(results[0], RemoteError)
+        self.assertEqual(results[1], 98)
+        self.assertEqual(len(obj), 98)
+
+    def test_batch(self):
+        self._server.register_type(list)
+        obj = self._client.factory(list)
+        with self._client.batch() as batch:
+            futures = [obj.append(i) for i in range(100)]
+            obj[0] = 'first'
+            error = obj.pop(1000)
+            last = obj.pop()
+            self.assertEqual(len(batch), 103)
+            self.assertFalse(last.done())
+        self.assertEqual([future.result() for future in futures],
+                         [None] * 100)
+        with self.assertRaises(RemoteError):
+            error.result()
+        self.assertEqual(last.result(), 99)
+        self.assertEqual(len(obj), 99)
+        self.assertEqual(obj[0], 'first')
+        # Nothing is sent on error
+        with self.assertRaises(ZeroDivisionError):
+            with self._client.batch():
+                obj.append(100)
+                1 / 0
+        self.assertEqual(len(obj), 99)
+
+    def test_promise(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(dict)
+        namespace = self._server._namespace
+        instances = len(namespace._instances)
+        promise = self._client.promise('TestObject', 'a').child('b').child('c')
+        self.assertEqual(promise.arg1.result(), 'c')
+        self.assertEqual(promise.result().arg1, 'c')
+        self.assertEqual(self._client.promise(dict, a=1)['a'].result(), 1)
+        # Remote attributes shadowed by the promise's own
+        promise.result().result = 'remote'
+        self.assertEqual(promise.__getattr__('result').result(), 'remote')
+        obj = self._client.factory('TestObject', 'first arg')
+        self.assertEqual(obj.child.promise('d').child('e').arg1.result(), 'e')
+        # Errors propagate along the chain
+        with self.assertRaises(RemoteError):
+            self._client.promise('TestObject', 'a').missing.child('b').result()
+        del promise, obj
+        # Errors hold promises in reference cycles
+        gc.collect()
+        _wait_until(lambda: len(namespace._instances) == instances)
+
+    def test_submit(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(list)
+        objs = [self._client.factory('TestObject', i) for i in range(4)]
+        # In flight together, each call waits for all others
+        BARRIERS['submit'] = Barrier(4, timeout=5)
+        futures = [obj.meet.submit('submit') for obj in objs[:3]]
+        self.assertFalse(any(future.done() for future in futures))
+        futures.append(objs[3].meet.submit('submit'))
+        for future in futures:
+            future.result()
+        futures = [self._client.submit(obj.child, 'child')
+                   for obj in objs]
+        self.assertEqual([future.result().arg1 for future in futures],
+                         ['child'] * 4)
+        obj = self._client.factory(list)
+        obj.append(1)
+        self.assertEqual(self._client.submit(obj.__getitem__, 0).result(), 1)
+        with self.assertRaises(RemoteError):
+            self._client.submit(obj.pop, 1000).result()
+        with self.assertRaises(TypeError):
+            self._client.submit(len, obj)
+
+    def test_submit_resolve(self):
+        self._server.register_type(TestObject)
+        obj = self._client.factory('TestObject', 'first arg')
+        self.assertEqual(list(obj.keyed().values()), [1])
+        # Resolved by the caller, not the thread receiving responses
+        self.assertEqual(list(obj.keyed.submit().result(timeout=5).values()),
+                         [1])
+        # Callbacks may make requests too
+        done = Event()
+        results = []
+
+        def callback(future):
+            results.append(future.result())
+            results.append(obj.arg1)
+            done.set()
+
+        obj.keyed.submit().add_done_callback(callback)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(list(results[0].values()), [1])
+        self.assertEqual(results[1], 'first arg')
+        # Unresolved results are released
+        instances = len(self._server._namespace._instances)
+        futures = [obj.keyed.submit(), obj.child.submit('b')]
+        self.assertFalse(wait(futures, timeout=5).not_done)
+        del futures
+        self._client._flush()
+        self.assertEqual(obj.arg1, 'first arg')
+        self.assertEqual(len(self._server._namespace._instances), instances)
+
+    def test_submit_released(self):
+        self._server.register_type(TestObject)
+        objs = [self._client.factory('TestObject', i)
+                for i in range(RELEASE_BATCH)]
+        busy = self._client.factory('TestObject', 'busy')
+        # Calls wait in the pool, while the proxies are released at once
+        EVENTS['busy'] = Event()
+        holds = [busy.hold.submit('busy') for _ in range(20)]
+        futures = []
+        while objs:
+            futures.append(objs.pop().getpid.submit())
+        EVENTS['busy'].set()
+        for future in holds + futures:
+            future.result()
+        with self._client.batch():
+            futures = [self._client.factory('TestObject', i).getpid()
+                       for i in range(RELEASE_BATCH)]
+        for future in futures:
+            future.result()
+
+    def test_oneway(self):
+        self._server.register_type(list)
+        self._server.register_type(TestObject)
+        obj = self._client.factory(list)
+        for i in range(1000):
+            obj.append.oneway(i)
+        self.assertEqual(len(obj), 1000)
+        self.assertEqual(obj[-1], 999)
+        # Errors are logged, results are discarded without references
+        test_obj = self._client.factory('TestObject', 'first arg')
+        instances = len(self._server._namespace._instances)
+        with self.assertLogs('server', level='ERROR'):
+            obj.pop.oneway(5000)
+            test_obj.child.oneway('b')
+            len(obj)
+        self.assertEqual(len(self._server._namespace._instances), instances)
+        # Made by the pool, not the thread of the connection
+        test_obj.note_thread.oneway()
+        self.assertFalse(test_obj.in_worker)
+
+    def test_async_client(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(list)
+
+        async def run():
+            async with await AsyncClient.connect(host=HOST, port=PORT) as cli:
+                obj = await cli.factory('TestObject', 'first arg')
+                self.assertEqual(await obj.arg1, 'first arg')
+                self.assertEqual(await obj.getpid(), os.getpid())
+                self.assertEqual(await (await obj.child('b')).arg1, 'b')
+                with self.assertRaises(RemoteError):
+                    await obj.missing()
+                # Many requests in flight, each waits for all others
+                objs = await asyncio.gather(
+                    *(cli.factory('TestObject', i) for i in range(4)))
+                BARRIERS['async'] = Barrier(4, timeout=5)
+                await asyncio.gather(*(obj.meet('async') for obj in objs))
+                lst = await cli.factory(list)
+                for i in range(100):
+                    await lst.append(i)
+                self.assertEqual(await lst[-1], 99)
+                self.assertEqual(await lst.__len__(), 100)
+                self.assertEqual([item async for item in lst],
+                                 list(range(100)))
+                objects = await obj.objects(3)
+                self.assertEqual([await item.arg1 async for item in objects],
+                                 [0, 1, 2])
+                async with obj as entered:
+                    self.assertEqual(await entered.arg1, 'first arg')
+                self.assertIsNone(await obj.exit_type)
+                with self.assertRaises(ValueError):
+                    async with obj:
+                        raise ValueError('failed')
+                self.assertEqual(await obj.exit_type, 'ValueError')
+                self.assertEqual(await obj.exit_value, 'failed')
+                # The reference made by a cancelled call is released
+                namespace = self._server._namespace
+                instances = len(namespace._instances)
+                task = asyncio.ensure_future(obj.child('c'))
+                await asyncio.sleep(0)
+                task.cancel()
+
+                async def released():
+                    while len(namespace._instances) != instances:
+                        await asyncio.sleep(0.01)
+                await asyncio.wait_for(released(), 5)
+
+        asyncio.run(run())
+
+    def test_async_temporary(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(list)
+        self._server.register_type(dict)
+
+        async def run():
+            async with await AsyncClient.connect(host=HOST, port=PORT) as cli:
+                # Proxies only referenced by the calls made on them
+                self.assertIsNone(await (await cli.factory(list)).append(1))
+                self.assertEqual(await (await cli.factory(dict, a=1))['a'], 1)
+                self.assertEqual(await (await cli.factory(
+                    'TestObject', 'a')).arg1, 'a')
+                child = await (await cli.factory('TestObject', 'a')).child('b')
+                self.assertEqual(await child.arg1, 'b')
+
+        asyncio.run(run())
+
+    def test_multiplexing(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(list)
+        slow = self._client.factory('TestObject', 'first arg')
+        fast = self._client.factory(list)
+        EVENTS['slow'] = Event()
+        held = []
+        thread = Thread(target=lambda: held.append(slow.hold('slow')))
+        thread.start()
+        # Calls from other threads do not wait for the slow call, which
+        # waits for them
+        for i in range(10):
+            fast.append(i)
+        self.assertEqual(len(fast), 10)
+        EVENTS['slow'].set()
+        thread.join()
+        self.assertEqual(held, [True])
+
+    def test_concurrency(self):
+        self._server.register_type(TestObject)
+        self._server.register_type(TestObject, name='SharedObject',
+                                   concurrency='shared')
+        with self.assertRaises(ValueError):
+            self._server.register_type(TestObject, name='BadObject',
+                                       concurrency='bad')
+        # Calls to different exclusive instances overlap, so they meet
+        self.assertEqual(self._concurrent_meets('TestObject', 5), [])
+        # Calls to instances of a shared type are serialized, so the first
+        # gives up waiting for the second, which finds the barrier broken
+        self.assertEqual(len(self._concurrent_meets('SharedObject', 0.5)), 2)
+
+    def test_processes(self):
+        self._server.register_type(TestObject, processes=2)
+        objs = [self._client.factory('TestObject', i) for i in range(4)]
+        pids = [obj.getpid() for obj in objs]
+        self.assertFalse(os.getpid() in pids)
+        self.assertEqual(len(set(pids)), 2)
+        self.assertEqual([obj.arg1 for obj in objs], list(range(4)))
+        with objs[0] as obj:
+            self.assertEqual(obj.getpid(), pids[0])
+        with self.assertRaises(RemoteError):
+            objs[0].sleep('not a number')
+        # Values by type, others by reference
+        self.assertEqual(objs[0].child('b').arg1, 'b')
+        self.assertEqual(objs[0].getpid(), pids[0])
+        self.assertEqual(len(objs[0].keyed()), 1)
+        # Unknown releases do not end the worker process
+        namespace = self._server._namespace
+        with namespace:
+            isolated = namespace[objs[0]._inst]
+        isolated._worker.release(0)
+        self.assertEqual(objs[0].getpid(), pids[0])
+
+    def _concurrent_meets(self, provider, timeout):
+        """Call meet() of two instances of a type from two clients at once.
+
+        Returns:
+            list: errors of the calls
+        """
+        clients = [Client(host=HOST, port=PORT) for _ in range(2)]
+        objs = [cli.factory(provider, 'first arg') for cli in clients]
+        BARRIERS[provider] = Barrier(2, timeout=timeout)
+        errors = []
+
+        def meet(obj):
+            try:
+                obj.meet(provider)
+            except RemoteError as ex:
+                errors.append(ex)
+        threads = [Thread(target=meet, args=(obj,)) for obj in objs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+
+class EventLoopServerClientTestCase(ServerClientTestCase):
+
+    engine = 'asyncio'
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'Requires fork().')
+class ProcessesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._server = Server()
+        self._server.register_type(TestObject)
+        kwargs = {'host': HOST, 'port': PORT, 'processes': 2}
+        if hasattr(socket, 'AF_UNIX'):
+            kwargs['path'] = PATH
+        self._server_thread = Thread(target=self._server.run, kwargs=kwargs)
+        self._server_thread.start()
+        self._server._wait_for()
+
+    def tearDown(self):
+        self._server._shutdown()
+        self._server_thread.join()
+
+    def test_processes(self):
+        pids = set()
+        for _ in range(50):
+            # Wait for all processes to listen
+            try:
+                client = Client(host=HOST, port=PORT)
+            except ConnectionRefusedError:
+                time.sleep(0.02)
+                continue
+            obj = client.factory('TestObject', 'first arg')
+            pid = obj.getpid()
+            # Connection stays with one process
+            self.assertEqual(obj.getpid(), pid)
+            self.assertNotEqual(pid, os.getpid())
+            pids.add(pid)
+            del obj, client
+        self.assertEqual(len(pids), 2)
+        if hasattr(socket, 'AF_UNIX'):
+            # The processes share the Unix domain socket
+            client = Client(path=PATH)
+            obj = client.factory('TestObject', 'first arg')
+            self.assertIn(obj.getpid(), pids)
+
+
+class Point:
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+
+register_codec(Point, 32, lambda point: bytes((point.x, point.y)),
+               lambda data: Point(*data))
+
+
+class Unreadable:
+
+    def itself(self):
+        return self
+
+
+def _unreadable(data):
+    raise ValueError('Unreadable')
+
+
+register_codec(Unreadable, 33, lambda obj: b'', _unreadable)
 
 
 class TestObject:
@@ -79,6 +776,54 @@ class TestObject:
 
     def __exit__(self, type, value, traceback):
         print('in __exit__()')
+        self.exit_type = type
+        self.exit_value = value
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def meet(self, name):
+        # Waits for the other calls to meet at the barrier
+        BARRIERS[name].wait()
+
+    def hold(self, name):
+        # Waits for the test to set the event
+        return EVENTS[name].wait(5)
+
+    def getpid(self):
+        return os.getpid()
+
+    def note_thread(self):
+        self.in_worker = isinstance(current_thread(), Worker)
+
+    def child(self, arg1):
+        return TestObject(arg1)
+
+    def objects(self, count):
+        for i in range(count):
+            yield TestObject(i)
+
+    def keyed(self):
+        # Keyed by a reference, hashed by a request once received
+        return {TestObject('key'): 1}
+
+
+def _wait_until(condition, timeout=5.0):
+    """Wait for a condition to hold, e.g. for releases sent in the
+    background to be handled.
+
+    Args:
+        condition (callable): returns whether the condition holds
+        timeout (float, optional): seconds to wait before failing
+
+    Raises:
+        AssertionError: If the condition does not hold in time.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Condition not met in time.')
+        time.sleep(0.01)
 
 
 if __name__ == '__main__':
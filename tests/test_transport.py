@@ -0,0 +1,161 @@
+"""Tests for transports.
+
+This module contains unit-tests for making transports from URLs.
+"""
+
+from crouton.inproc import Pipe
+from crouton.shm import SharedMemoryChannel, shared_memory
+from crouton.transport import InprocTransport, TcpTransport, \
+    UnixTransport, transport
+from threading import Thread
+import os
+import socket
+import unittest
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def test_url(self):
+        trans = transport('tcp://127.0.0.1:5003')
+        self.assertIsInstance(trans, TcpTransport)
+        self.assertEqual((trans.host, trans.port), ('127.0.0.1', 5003))
+        self.assertEqual(str(trans), 'tcp://127.0.0.1:5003')
+        self.assertIs(transport(trans), trans)
+        if hasattr(socket, 'AF_UNIX'):
+            trans = transport('unix:///tmp/crouton.sock')
+            self.assertIsInstance(trans, UnixTransport)
+            self.assertEqual(trans.path, '/tmp/crouton.sock')
+        trans = transport('inproc://name')
+        self.assertIsInstance(trans, InprocTransport)
+        self.assertEqual(trans.name, 'name')
+        with self.assertRaises(ValueError):
+            transport('udp://localhost:5003')
+        with self.assertRaises(ValueError):
+            transport('tcp://localhost')
+        with self.assertRaises(ValueError):
+            transport('tcp://localhost:5003?nagle=1')
+
+    def test_options(self):
+        trans = transport('tcp://localhost:5003?nodelay=0&keepalive=yes'
+                          '&sndbuf=65536', rcvbuf=65536)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            trans.configure(sock)
+            self.assertFalse(sock.getsockopt(socket.IPPROTO_TCP,
+                                             socket.TCP_NODELAY))
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_KEEPALIVE))
+            # Linux doubles the sizes, for its bookkeeping
+            self.assertGreaterEqual(sock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF), 65536)
+            self.assertGreaterEqual(sock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF), 65536)
+            transport('tcp://localhost:5003').configure(sock)
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP,
+                                            socket.TCP_NODELAY))
+        finally:
+            sock.close()
+
+    def test_inproc(self):
+        trans = transport('inproc://crouton-transport')
+        listener = trans.listen()
+        try:
+            with self.assertRaises(BlockingIOError):
+                trans.accept(listener)
+            with self.assertRaises(OSError):
+                trans.listen()
+            client = trans.connect()
+            server, address = trans.accept(listener)
+            self.assertEqual(address, 'inproc://crouton-transport')
+            client.sendall(b'hello')
+            client.sendall(memoryview(b' world'))
+            self.assertEqual(server.recv(3), b'hel')
+            view = memoryview(bytearray(8))
+            self.assertEqual(server.recv_into(view), 2)
+            self.assertEqual(server.recv(100), b' world')
+            # Data sent is received before the end of the connection
+            server.sendall(b'bye')
+            server.close()
+            self.assertEqual(client.recv(100), b'bye')
+            self.assertEqual(client.recv(100), b'')
+            with self.assertRaises(ConnectionError):
+                client.sendall(b'more')
+        finally:
+            trans.close(listener)
+        with self.assertRaises(ConnectionRefusedError):
+            trans.connect()
+
+    def test_pipe_full(self):
+        pipe = Pipe(size=4)
+        pipe.write(b'abc')
+        writer = Thread(target=pipe.write, args=(b'de',))
+        writer.start()
+        # Waits for room
+        writer.join(0.1)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(pipe.read(2), b'ab')
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(pipe.read(10), b'c')
+        self.assertEqual(pipe.read(10), b'de')
+        # Data larger than the pipe is queued once it is empty
+        pipe.write(b'0123456789')
+        self.assertEqual(pipe.read(100), b'0123456789')
+        # Closing wakes a waiting writer
+        pipe.write(b'abcd')
+        errors = []
+
+        def write():
+            try:
+                pipe.write(b'e')
+            except ConnectionError as ex:
+                errors.append(ex)
+        writer = Thread(target=write)
+        writer.start()
+        writer.join(0.1)
+        pipe.close_read()
+        writer.join(5)
+        self.assertEqual(len(errors), 1)
+
+    @unittest.skipUnless(shared_memory and hasattr(socket, 'AF_UNIX'),
+                         'Requires shared memory and Unix domain sockets.')
+    def test_shared_memory(self):
+        client_sock, server_sock = socket.socketpair()
+        channel = SharedMemoryChannel.create(client_sock, size=64)
+        try:
+            # Only the shared memory of the channel is attached
+            with self.assertRaises(PermissionError):
+                SharedMemoryChannel.attach(server_sock, 'other', 64,
+                                           channel.nonce)
+            with self.assertRaises(PermissionError):
+                SharedMemoryChannel.attach(server_sock, channel.name, 64,
+                                           bytes(len(channel.nonce)))
+            if os.name == 'posix':
+                os.fchmod(channel._memory._fd, 0o644)
+                with self.assertRaises(PermissionError):
+                    SharedMemoryChannel.attach(server_sock, channel.name, 64,
+                                               channel.nonce)
+                os.fchmod(channel._memory._fd, 0o600)
+            server = SharedMemoryChannel.attach(server_sock, channel.name, 64,
+                                                channel.nonce)
+        finally:
+            channel.unlink()
+        # Data larger than the rings, read by a waiting reader
+        received = []
+
+        def receive():
+            while sum(map(len, received)) < 1000:
+                received.append(server.recv(100))
+        reader = Thread(target=receive)
+        reader.start()
+        data = os.urandom(1000)
+        channel.sendall(data)
+        reader.join(5)
+        self.assertEqual(b''.join(received), data)
+        channel.close()
+        self.assertEqual(server.recv(100), b'')
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()